@@ -0,0 +1,69 @@
+"""
+Bytes on wire and CPU time per response of the response compression
+encodings for users list payloads of the list endpoints. Encodings of not
+installed packages (brotli, zstandard) are skipped. Rows are generated, so
+it doesn't need a database:
+
+    python -m benchmarks.compression --repeat 20
+"""
+import argparse
+import random
+import string
+import time
+
+from ratingsite.compression import COMPRESSORS
+from ratingsite.encoders import dumps
+
+
+# Users count returned by an endpoint in one response
+PAYLOADS = {
+    'search page (limit=20)': 20,
+    'users page (limit=500)': 500,
+    'all users (10000)': 10000,
+    'all users (100000)': 100000,
+}
+
+
+def _random_name(length: int) -> str:
+    return ''.join(random.choices(string.ascii_lowercase, k=length))
+
+
+def generate_payload(count: int) -> bytes:
+    """Generate users list JSON with random nicknames and names"""
+    random.seed(count)
+    return dumps([{
+        'id': user_id,
+        'nickname': _random_name(random.randint(5, 15)),
+        'first_name': _random_name(random.randint(3, 10)).title(),
+        'last_name': _random_name(random.randint(4, 12)).title(),
+        'is_superuser': False,
+    } for user_id in range(1, count + 1)])
+
+
+def measure_cpu(compress, body: bytes, repeat: int) -> float:
+    """Get mean CPU time of the compression in milliseconds"""
+    start = time.process_time()
+    for _ in range(repeat):
+        compress(body)
+    return (time.process_time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for name, count in PAYLOADS.items():
+        body = generate_payload(count)
+        print(f'{name}: {len(body)} bytes')
+        for encoding, compress in COMPRESSORS.items():
+            compressed_size = len(compress(body))
+            cpu = measure_cpu(compress, body, args.repeat)
+            print(
+                f'  {encoding:>4}: {compressed_size} bytes '
+                f'({compressed_size / len(body):.1%}), {cpu:.3f}ms CPU'
+            )
+
+
+if __name__ == '__main__':
+    main()
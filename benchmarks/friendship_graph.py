@@ -0,0 +1,91 @@
+"""
+Memory footprint and lookup latency of the in-process friendship graph.
+Friendships are generated with skewed degrees (a few users have many
+friends), so it doesn't need a database:
+
+    python -m benchmarks.friendship_graph --users 1000000 --links 20000000
+
+Every friendship is two links (both users added each other) like in
+users_friends_association
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from array import array
+
+from users.graph import FriendshipGraph
+
+
+def generate_friends(users: int, links: int) -> dict[int, array]:
+    """Generate friendships as unsorted arrays of friends ids per user"""
+    friends = {}
+    for _ in range(links // 2):
+        # Ids of one side are skewed to small ones
+        first_id = 1 + int(users * random.random() ** 2)
+        second_id = random.randint(1, users)
+        if first_id == second_id: continue
+        friends.setdefault(first_id, array('i')).append(second_id)
+        friends.setdefault(second_id, array('i')).append(first_id)
+    return friends
+
+
+def build_links(friends: dict[int, array]) -> dict[int, array]:
+    """Build sorted arrays without duplicates like load_links returns"""
+    return {
+        user_id: array('i', sorted(set(ids)))
+        for user_id, ids in friends.items()
+    }
+
+
+def measure(func, calls: int) -> float:
+    """Get mean call duration in microseconds"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--links', type=int, default=20_000_000)
+    parser.add_argument('--calls', type=int, default=10000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    friends = generate_friends(args.users, args.links)
+    generated = time.perf_counter() - start
+    # Only the graph is traced, tracing of the generation is too slow
+    tracemalloc.start()
+    graph = FriendshipGraph()
+    graph.reset(build_links(friends))
+    del friends
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    links_count = graph.links_count
+    print(
+        f'{len(graph)} users, {links_count} links generated in '
+        f'{generated:.1f}s\nmemory: {current / 2 ** 20:.1f} MiB '
+        f'({current / links_count:.1f} bytes per link), '
+        f'peak while building {peak / 2 ** 20:.1f} MiB'
+    )
+
+    user_ids = [random.randint(1, args.users) for _ in range(args.calls)]
+    other_ids = [random.randint(1, args.users) for _ in range(args.calls)]
+    pairs = iter(list(zip(user_ids, other_ids)) * 2)
+    ids = iter(user_ids * 3)
+    for name, func, calls in (
+        ('are_friends', lambda: graph.are_friends(*next(pairs)), args.calls),
+        ('count_friends', lambda: graph.count_friends(next(ids)),
+            args.calls),
+        ('get_mutual_friends',
+            lambda: graph.get_mutual_friends(*next(pairs)), args.calls),
+        ('suggest_friends', lambda: graph.suggest_friends(next(ids)),
+            min(args.calls, 1000)),
+    ):
+        print(f'{name}: {measure(func, calls):.1f}us')
+
+
+if __name__ == '__main__':
+    main()
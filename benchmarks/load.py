@@ -0,0 +1,248 @@
+"""
+Load test of the users API routes. Run from the project root against a
+running server and a database seeded by benchmarks.seed:
+
+    python -m benchmarks.load --url http://localhost:8080 \\
+        --duration 30 --concurrency 50 --max-p99-ms 200
+
+Every virtual user logs in as a random seeded user and sends requests to
+random routes (weighted by `ROUTES`). Prints throughput, errors and
+p50/p95/p99 latency of every route and exits with status 1 if any request
+failed or the overall p99 is over `--max-p99-ms`, so it can gate
+regressions. Rejected requests are errors too, so raise `rate_limit` of
+the server for the run
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+import aiohttp
+
+from benchmarks.seed import SEED_PASSWORD, FIRST_NAMES
+
+
+class LoadClient:
+    """Virtual user sending requests with its own JWT token"""
+
+    def __init__(self, session: aiohttp.ClientSession, url: str,
+            nicknames: list[str], user_ids: list[int]) -> None:
+        self._session = session
+        self._url = url
+        self._nicknames = nicknames
+        self._user_ids = user_ids
+        self._headers = {}
+
+    def _random_nickname(self) -> str:
+        return random.choice(self._nicknames)
+
+    async def _request(self, method: str, path: str, **kwargs) -> int:
+        async with self._session.request(
+            method, self._url + path, headers=self._headers, **kwargs
+        ) as response:
+            await response.read()
+            return response.status
+
+    async def login(self, password: str) -> int:
+        nickname = self._random_nickname()
+        async with self._session.post(self._url + '/api/v1/login/', json={
+            'email': f'{nickname}@example.com', 'password': password
+        }) as response:
+            if response.status == 200:
+                data = await response.json()
+                self._headers = {
+                    'Authorization': f"Bearer {data['jwt_token']}"
+                }
+            return response.status
+
+    async def registration(self) -> int:
+        nickname = f'load_{uuid.uuid4().hex[:16]}'
+        return await self._request('POST', '/api/v1/registration/', json={
+            'nickname': nickname, 'email': f'{nickname}@example.com',
+            'password1': SEED_PASSWORD, 'password2': SEED_PASSWORD,
+            'first_name': random.choice(FIRST_NAMES), 'last_name': 'Load'
+        })
+
+    async def all_users(self) -> int:
+        after_id = random.choice(self._user_ids)
+        return await self._request(
+            'GET', f'/api/v1/users/?after_id={after_id}&limit=50'
+        )
+
+    async def users_batch(self) -> int:
+        return await self._request('POST', '/api/v1/users/batch/', json={
+            'nicknames': random.sample(
+                self._nicknames, min(20, len(self._nicknames))
+            )
+        })
+
+    async def add_friend(self) -> int:
+        return await self._request('POST', '/api/v1/friends/add/', json={
+            'id': random.choice(self._user_ids)
+        })
+
+    async def user_friends(self) -> int:
+        return await self._request(
+            'GET', f'/api/v1/friends/{self._random_nickname()}/?limit=50'
+        )
+
+    async def current_user(self) -> int:
+        return await self._request('GET', '/api/v1/users/current/')
+
+    async def search(self) -> int:
+        term = random.choice(FIRST_NAMES)[:random.randint(2, 5)]
+        return await self._request('GET', f'/api/v1/users/search/{term}/')
+
+    async def another_user(self) -> int:
+        return await self._request(
+            'GET', f'/api/v1/users/{self._random_nickname()}/'
+        )
+
+
+# Route name, client method name and weight
+ROUTES = [
+    ('registration', 'registration', 1),
+    ('login', 'login', 2),
+    ('users', 'all_users', 10),
+    ('users_batch', 'users_batch', 5),
+    ('friends_add', 'add_friend', 3),
+    ('user_friends', 'user_friends', 15),
+    ('current_user', 'current_user', 15),
+    ('search', 'search', 10),
+    ('another_user', 'another_user', 40),
+]
+
+# Expected business errors (unknown user, conflicts). Any other client
+# error (401 of a broken login, 429 of rate limits) is an error
+EXPECTED_CLIENT_ERRORS = {404, 409}
+
+# Business errors of routes responding with 400 (already in friends)
+EXPECTED_ROUTE_ERRORS = {'friends_add': {400}}
+
+
+def is_error(name: str, status: Optional[int]) -> bool:
+    """Check is the response status of the route an error"""
+    if status is None or status >= 500: return True
+    if status < 400: return False
+    return not (
+        status in EXPECTED_CLIENT_ERRORS or
+        status in EXPECTED_ROUTE_ERRORS.get(name, ())
+    )
+
+
+async def fetch_seeded_users(session: aiohttp.ClientSession, url: str,
+        limit: int) -> tuple[list[str], list[int]]:
+    """Get nicknames and ids of up to `limit` seeded users"""
+    nicknames, user_ids = [], []
+    after_id = 0
+    while len(nicknames) < limit:
+        async with session.get(
+            f'{url}/api/v1/users/?after_id={after_id}&limit=500'
+        ) as response:
+            page = await response.json()
+        if not page: break
+        for user in page:
+            if user['nickname'].startswith('seed_'):
+                nicknames.append(user['nickname'])
+                user_ids.append(user['id'])
+        after_id = page[-1]['id']
+    return nicknames[:limit], user_ids[:limit]
+
+
+async def run_client(client: LoadClient, password: str, deadline: float,
+        durations: dict, errors: dict) -> None:
+    if is_error('login', await client.login(password)): errors['login'] += 1
+    names = [name for name, _, _ in ROUTES]
+    weights = [weight for _, _, weight in ROUTES]
+    methods = {name: method for name, method, _ in ROUTES}
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            if name == 'login':
+                status = await client.login(password)
+            else:
+                status = await getattr(client, methods[name])()
+        except aiohttp.ClientError:
+            status = None
+        durations[name].append(time.perf_counter() - start)
+        if is_error(name, status): errors[name] += 1
+
+
+def percentiles(durations: list[float]) -> tuple[float, float, float]:
+    """Get p50, p95 and p99 in milliseconds"""
+    if len(durations) < 2: return (sum(durations) * 1000,) * 3
+    quantiles = statistics.quantiles(durations, n=100)
+    return tuple(quantiles[i] * 1000 for i in (49, 94, 98))
+
+
+def report(durations: dict, errors: dict, elapsed: float) -> float:
+    """Print the report and return the overall p99 in milliseconds"""
+    print(
+        f"{'route':<14}{'requests':>10}{'errors':>8}{'rps':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    all_durations = []
+    for name, _, _ in ROUTES:
+        route_durations = durations[name]
+        all_durations.extend(route_durations)
+        p50, p95, p99 = percentiles(route_durations)
+        print(
+            f'{name:<14}{len(route_durations):>10}{errors[name]:>8}'
+            f'{len(route_durations) / elapsed:>10.1f}'
+            f'{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}'
+        )
+    p50, p95, p99 = percentiles(all_durations)
+    print(
+        f"{'total':<14}{len(all_durations):>10}"
+        f'{sum(errors.values()):>8}{len(all_durations) / elapsed:>10.1f}'
+        f'{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}'
+    )
+    return p99
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--users', type=int, default=5000,
+        help='number of seeded users to use')
+    parser.add_argument('--password', default=SEED_PASSWORD)
+    parser.add_argument('--max-p99-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        nicknames, user_ids = await fetch_seeded_users(
+            session, args.url, args.users
+        )
+        if not nicknames:
+            sys.exit('There are no seeded users, run benchmarks.seed first')
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            run_client(
+                LoadClient(session, args.url, nicknames, user_ids),
+                args.password, deadline, durations, errors
+            ) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    p99 = report(durations, errors, elapsed)
+    errors_count = sum(errors.values())
+    if errors_count: sys.exit(f'{errors_count} requests failed')
+    if args.max_p99_ms is not None and p99 > args.max_p99_ms:
+        sys.exit(f'p99 {p99:.2f}ms is over {args.max_p99_ms}ms')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Logins per second per core. Without a database it measures pbkdf2_sha256
+verifications per second of CPU for different rounds to tune
+`password_hashing.rounds`:
+
+    python -m benchmarks.login --rounds 10000 29000 100000
+
+With `--db` it also runs LoginService logins of a seeded user (see
+benchmarks.seed) against the configured database on one hasher thread:
+without the login cache (a query per login, the old path) and with it,
+and logins of an unknown email, which should take as long as the others
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiopg.sa
+
+from benchmarks.seed import SEED_PASSWORD
+from ratingsite.cache import LRUCache
+from ratingsite.settings import config
+from users.passwords import (
+    PasswordHasher, hash_password, verify_password, DEFAULT_ROUNDS
+)
+from users.serializers import LoginData
+from users.services import LoginService
+
+
+def measure_verify(rounds: int, verifications: int) -> float:
+    """Get verifications per second of CPU"""
+    password_hash = hash_password(SEED_PASSWORD, rounds)
+    start = time.process_time()
+    for _ in range(verifications):
+        verify_password(SEED_PASSWORD, password_hash)
+    return verifications / (time.process_time() - start)
+
+
+async def measure_logins(service: LoginService, email: str,
+        logins: int) -> tuple[float, float]:
+    """Get logins per second and mean login duration in milliseconds"""
+    auth_data = LoginData(email=email, password=SEED_PASSWORD)
+    await service.login_user(auth_data)
+    start = time.perf_counter()
+    for _ in range(logins):
+        await service.login_user(auth_data)
+    duration = time.perf_counter() - start
+    return logins / duration, duration / logins * 1000
+
+
+async def compare_logins(email: str, logins: int) -> None:
+    rounds = config.get('password_hashing', {}).get('rounds', DEFAULT_ROUNDS)
+    executor = ThreadPoolExecutor(1)
+    hasher = PasswordHasher(executor, 1, rounds)
+    async with aiopg.sa.create_engine(**config['postgres']) as engine:
+        for name, service, login_email in (
+            ('without cache', LoginService(engine, hasher), email),
+            ('with cache', LoginService(
+                engine, hasher, LRUCache(1000, 60)
+            ), email),
+            ('unknown email', LoginService(
+                engine, hasher, LRUCache(1000, 60)
+            ), f'unknown.{email}'),
+        ):
+            per_second, mean = await measure_logins(
+                service, login_email, logins
+            )
+            print(f'{name}: {per_second:.1f} logins/s, {mean:.2f}ms')
+    executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--rounds', type=int, nargs='+', default=[10000, 29000, 100000]
+    )
+    parser.add_argument('--verifications', type=int, default=50)
+    parser.add_argument('--db', action='store_true')
+    parser.add_argument('--email', default='seed_1@example.com')
+    parser.add_argument('--logins', type=int, default=200)
+    args = parser.parse_args()
+
+    for rounds in args.rounds:
+        per_second = measure_verify(rounds, args.verifications)
+        print(f'{rounds} rounds: {per_second:.1f} verifications/s per core')
+
+    if args.db: asyncio.run(compare_logins(args.email, args.logins))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare latency of loading a user profile with three sequential queries
+(the old GetAnotherUserInfoService) and with the single statement profile
+loader. Run from the project root against a seeded database:
+
+    python -m benchmarks.profile_latency --viewer-id 1 --requests 2000 nick1
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiopg.sa
+
+from ratings.services import GetUserRatingService
+from ratingsite.settings import config
+from users.services import GetAnotherUserInfoService, get_user_info
+
+
+async def old_get_info(conn, viewer_id, nickname: str) -> dict:
+    user_info = await get_user_info(conn, nickname)
+    rating_service = GetUserRatingService(conn, viewer_id)
+    user_info['rating'] = await rating_service.get_user_rating(
+        user_info['id']
+    )
+    return user_info
+
+
+async def new_get_info(conn, viewer_id, nickname: str) -> dict:
+    return await GetAnotherUserInfoService(conn, viewer_id).get_info(nickname)
+
+
+async def measure(engine, loader, viewer_id, nicknames: list[str],
+        requests: int, concurrency: int) -> list[float]:
+    durations = []
+
+    async def worker(worker_number: int):
+        for i in range(worker_number, requests, concurrency):
+            nickname = nicknames[i % len(nicknames)]
+            start = time.perf_counter()
+            async with engine.acquire() as conn:
+                await loader(conn, viewer_id, nickname)
+            durations.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return durations
+
+
+def report(name: str, durations: list[float]) -> None:
+    quantiles = statistics.quantiles(durations, n=100)
+    print(
+        f'{name}: p50={quantiles[49] * 1000:.2f}ms '
+        f'p99={quantiles[98] * 1000:.2f}ms '
+        f'mean={statistics.mean(durations) * 1000:.2f}ms'
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('nicknames', nargs='+')
+    parser.add_argument('--viewer-id', type=int, default=None)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    async with aiopg.sa.create_engine(**config['postgres']) as engine:
+        for name, loader in (('old', old_get_info), ('new', new_get_info)):
+            durations = await measure(
+                engine, loader, args.viewer_id, args.nicknames,
+                args.requests, args.concurrency
+            )
+            report(name, durations)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+Measure CPU time per call spent on SQL construction of the hot lookup
+paths: building and compiling SQLAlchemy statements on every call (the old
+services) and getting parameters of statements compiled once by the query
+registry. Runs without a database:
+
+    python -m benchmarks.query_compile --calls 20000
+
+With `--db` it also compares latency of executing the compiled statements
+and the registry prepared statements against the configured database
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiopg.sa
+from sqlalchemy import or_, func, select
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+from ratingsite.queries import QUERIES
+from ratingsite.settings import config
+from users.db import users
+from users.services import (
+    USER_COLUMNS, USER_BY_NICKNAME_QUERY, LOGIN_USER_BY_EMAIL_QUERY,
+    USER_FRIENDS_QUERY, SEARCH_USERS_QUERY, SearchUsersService,
+    _escape_like, _select_friends
+)
+
+
+def old_user_by_nickname(nickname: str):
+    return select(USER_COLUMNS).where(users.c.nickname == nickname)
+
+
+def old_login_user_by_email(email: str):
+    return select([
+        users.c.id, users.c.email, users.c.nickname, users.c.password,
+        users.c.disabled
+    ]).where(users.c.email == email)
+
+
+def old_user_friends(user_id: int, after_id: int, limit: int):
+    query, friend_link = _select_friends(users, user_id, USER_COLUMNS)
+    return query.where(friend_link.c.second_id > after_id).limit(limit)
+
+
+def old_search(search_by: str, current_user_id: int):
+    like_exp = f"%{_escape_like(search_by)}%"
+    is_prefix = func.lower(users.c.nickname).like(
+        f"{_escape_like(search_by.lower())}%"
+    )
+    rank = func.greatest(
+        func.similarity(users.c.nickname, search_by),
+        func.similarity(users.c.first_name, search_by),
+        func.similarity(users.c.last_name, search_by),
+    )
+    return select(USER_COLUMNS).where(or_(
+        is_prefix,
+        users.c.nickname.ilike(like_exp),
+        users.c.first_name.ilike(like_exp),
+        users.c.last_name.ilike(like_exp)
+    )).order_by(
+        is_prefix.desc(), rank.desc(), users.c.id
+    ).limit(20).offset(0).where(users.c.id != current_user_id)
+
+
+# Name, old statement factory, registry query and its parameters
+CASES = [
+    ('user_by_nickname', lambda: old_user_by_nickname('seed_1'),
+        USER_BY_NICKNAME_QUERY, {'nickname': 'seed_1'}),
+    ('login_user_by_email',
+        lambda: old_login_user_by_email('seed_1@example.com'),
+        LOGIN_USER_BY_EMAIL_QUERY, {'email': 'seed_1@example.com'}),
+    ('user_friends', lambda: old_user_friends(1, 0, 50),
+        USER_FRIENDS_QUERY, {'user_id': 1, 'after_id': 0, 'limit': 50}),
+    ('search_users', lambda: old_search('iva', 1), SEARCH_USERS_QUERY,
+        SearchUsersService(None, 1)._get_query_params('iva')),
+]
+
+
+def compile_old(factory, dialect) -> tuple[str, dict]:
+    """Build and compile the statement like aiopg.sa does on execute"""
+    compiled = factory().compile(dialect=dialect)
+    processors = compiled._bind_processors
+    params = {
+        key: processors[key](value) if key in processors else value
+        for key, value in compiled.params.items()
+    }
+    return str(compiled), params
+
+
+def measure_cpu(func, calls: int) -> float:
+    """Get mean CPU time of the call in microseconds"""
+    start = time.process_time()
+    for _ in range(calls):
+        func()
+    return (time.process_time() - start) / calls * 1_000_000
+
+
+async def measure_db(engine, execute, requests: int) -> list[float]:
+    durations = []
+    async with engine.acquire() as conn:
+        for _ in range(requests):
+            start = time.perf_counter()
+            cursor = await execute(conn)
+            await cursor.fetchall()
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def compare_db(requests: int) -> None:
+    async with aiopg.sa.create_engine(**config['postgres']) as engine:
+        for name, factory, query, params in CASES:
+            for variant, execute in (
+                ('old', lambda conn: conn.execute(factory())),
+                ('prepared', lambda conn: QUERIES.execute(
+                    conn, query, **params
+                )),
+            ):
+                durations = await measure_db(engine, execute, requests)
+                quantiles = statistics.quantiles(durations, n=100)
+                print(
+                    f'{name} {variant}: p50={quantiles[49] * 1000:.3f}ms '
+                    f'p99={quantiles[98] * 1000:.3f}ms'
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--db', action='store_true')
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    dialect = PGDialect_psycopg2()
+    for name, factory, query, params in CASES:
+        old = measure_cpu(lambda: compile_old(factory, dialect), args.calls)
+        new = measure_cpu(lambda: query.get_params(**params), args.calls)
+        print(
+            f'{name}: build and compile {old:.1f}us, '
+            f'compiled once {new:.2f}us ({old / new:.0f}x)'
+        )
+
+    if args.db: asyncio.run(compare_db(args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare query plans of the old ILIKE users search and the new trigram
+search. Run from the project root:
+
+    python -m benchmarks.search_plans --seed 1000000 ivan petr an
+
+`--seed N` fills the users table up to N generated users first (don't run
+it against a production database)
+"""
+import argparse
+
+from sqlalchemy import create_engine, or_, text
+
+from init_db import DSN, create_tables
+from ratingsite.settings import config
+from users.db import users
+from users.services import (
+    SearchUsersService, SEARCH_USERS_QUERY,
+    SEARCH_USERS_BY_NICKNAME_PREFIX_QUERY
+)
+
+
+SEED_QUERY = """
+INSERT INTO users (nickname, first_name, last_name, email, password,
+                   is_superuser, disabled)
+SELECT 'user_' || md5(i::text), 'First' || (i % 5000),
+       'Last' || (i % 20000), 'user' || i || '@example.com', '-',
+       false, false
+FROM generate_series(:start, :stop) AS i
+"""
+
+
+def old_search_query(search_by: str):
+    like_exp = f"%{search_by}%"
+    return users.select().where(or_(
+        users.c.nickname.ilike(like_exp),
+        users.c.first_name.ilike(like_exp),
+        users.c.last_name.ilike(like_exp)
+    ))
+
+
+def seed_users(conn, users_count: int) -> None:
+    existing = conn.execute(text('SELECT count(*) FROM users')).scalar()
+    if existing >= users_count: return
+    conn.execute(text(SEED_QUERY), start=existing + 1, stop=users_count)
+    conn.execute(text('ANALYZE users'))
+
+
+def explain(conn, query, params: dict = None) -> list[str]:
+    compiled = query.compile(dialect=conn.dialect)
+    rows = conn.exec_driver_sql(
+        'EXPLAIN (ANALYZE, BUFFERS) ' + str(compiled),
+        dict(compiled.params, **(params or {}))
+    )
+    return [row[0] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('terms', nargs='+')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_engine(DSN.format(**config['postgres']))
+    create_tables(engine)
+    service = SearchUsersService(None, None)
+    with engine.begin() as conn:
+        if args.seed: seed_users(conn, args.seed)
+        for term in args.terms:
+            for name, query, params in (
+                ('old', old_search_query(term), None),
+                ('new', SEARCH_USERS_QUERY.statement,
+                    SEARCH_USERS_QUERY.get_params(
+                        **service._get_query_params(term)
+                    )),
+                ('new nickname prefix',
+                    SEARCH_USERS_BY_NICKNAME_PREFIX_QUERY.statement,
+                    SEARCH_USERS_BY_NICKNAME_PREFIX_QUERY.get_params(
+                        **service._get_nickname_prefix_params(term, 20, 0)
+                    )),
+            ):
+                print(f'=== {name}: {term!r}')
+                print('\n'.join(explain(conn, query, params)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Seed the database with generated users, friendships and ratings for
+benchmarks and load tests. Run from the project root:
+
+    python -m benchmarks.seed --users 100000 --ratings-per-user 5
+
+Rows are written with COPY. Friendship and ratings degrees follow a power
+law (a few users have thousands of friends, most have a few). All seeded
+users have the `--password` password and `seed_<n>` nicknames, so they can
+be used by benchmarks.load. Don't run it against a production database
+"""
+import argparse
+import io
+import random
+import time
+
+from sqlalchemy import create_engine
+
+from init_db import DSN, create_tables
+from ratings.db import (
+    RATING_MIN_VALUE, RATING_MAX_VALUE, rating_stats_backfill_ddl
+)
+from ratingsite.settings import config
+from users.passwords import hash_password
+
+
+SEED_PASSWORD = 'Seedpassw0rd!'
+
+COPY_CHUNK_ROWS = 100000
+
+FIRST_NAMES = [
+    'Ivan', 'Petr', 'Anna', 'Maria', 'Alexey', 'Olga', 'Dmitry', 'Elena',
+    'Sergey', 'Natalia', 'John', 'Emma', 'Liam', 'Sophia', 'Noah', 'Mia',
+]
+
+LAST_NAMES = [
+    'Ivanov', 'Petrov', 'Sidorov', 'Smirnov', 'Kuznetsov', 'Popov',
+    'Smith', 'Johnson', 'Brown', 'Taylor', 'Miller', 'Wilson', 'Moore',
+]
+
+
+def power_law_degree(alpha: float, max_degree: int) -> int:
+    """Random degree from Pareto distribution with minimum 1"""
+    return min(int(random.paretovariate(alpha)), max_degree)
+
+
+def copy_rows(cursor, table: str, columns: list[str], rows) -> int:
+    """COPY tab separated `rows` into the table in chunks, return count"""
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    count = 0
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(str, row)) + '\n')
+        count += 1
+        if count % COPY_CHUNK_ROWS == 0:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            buffer = io.StringIO()
+    buffer.seek(0)
+    cursor.copy_expert(statement, buffer)
+    return count
+
+
+def generate_users(first_id: int, count: int, password_hash: str):
+    for user_id in range(first_id, first_id + count):
+        yield (
+            user_id, f'seed_{user_id}', random.choice(FIRST_NAMES),
+            random.choice(LAST_NAMES), f'seed_{user_id}@example.com',
+            password_hash, 'f', 'f'
+        )
+
+
+def generate_friendships(first_id: int, count: int, alpha: float,
+        max_degree: int):
+    """
+    Generate friendship links of every user to its power law distributed
+    number of random users
+    """
+    last_id = first_id + count - 1
+    for user_id in range(first_id, last_id + 1):
+        friends = {
+            random.randint(first_id, last_id)
+            for _ in range(power_law_degree(alpha, max_degree))
+        }
+        friends.discard(user_id)
+        for friend_id in friends:
+            yield user_id, friend_id
+
+
+def generate_ratings(first_id: int, count: int, mean_ratings: float,
+        alpha: float):
+    """
+    Generate ratings of every user to its power law distributed number of
+    random users, scaled so the mean number of ratings is `mean_ratings`
+    """
+    last_id = first_id + count - 1
+    # Mean of Pareto distribution is alpha / (alpha - 1)
+    scale = mean_ratings * (alpha - 1) / alpha
+    for creator_id in range(first_id, last_id + 1):
+        ratings_count = min(
+            int(random.paretovariate(alpha) * scale), count - 1
+        )
+        receivers = {
+            random.randint(first_id, last_id) for _ in range(ratings_count)
+        }
+        receivers.discard(creator_id)
+        for receiver_id in receivers:
+            yield (
+                creator_id, receiver_id,
+                random.randint(RATING_MIN_VALUE, RATING_MAX_VALUE), 'seed'
+            )
+
+
+def seed(engine, args) -> None:
+    password_hash = hash_password(args.password)
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute('SELECT coalesce(max(id), 0) + 1 FROM users')
+        first_id = cursor.fetchone()[0]
+
+        start = time.perf_counter()
+        count = copy_rows(cursor, 'users', [
+            'id', 'nickname', 'first_name', 'last_name', 'email',
+            'password', 'is_superuser', 'disabled'
+        ], generate_users(first_id, args.users, password_hash))
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('users', 'id'), "
+            "(SELECT max(id) FROM users))"
+        )
+        print(f'users: {count} in {time.perf_counter() - start:.1f}s')
+
+        # Links are copied into a staging table and inserted in both
+        # directions (friends follow each other) skipping duplicates
+        start = time.perf_counter()
+        cursor.execute(
+            'CREATE TEMP TABLE seed_friendships '
+            '(first_id integer, second_id integer)'
+        )
+        copy_rows(cursor, 'seed_friendships', ['first_id', 'second_id'],
+            generate_friendships(
+                first_id, args.users, args.alpha, args.max_friends
+            ))
+        cursor.execute("""
+            INSERT INTO users_friends_association (first_id, second_id)
+            SELECT first_id, second_id FROM seed_friendships
+            UNION
+            SELECT second_id, first_id FROM seed_friendships
+            ON CONFLICT DO NOTHING
+        """)
+        print(
+            f'friendship links: {cursor.rowcount} in '
+            f'{time.perf_counter() - start:.1f}s'
+        )
+
+        # The stats trigger is disabled during COPY, stats of seeded users
+        # are computed by the backfill afterwards
+        start = time.perf_counter()
+        cursor.execute(
+            'ALTER TABLE ratings DISABLE TRIGGER '
+            'ratings_update_user_rating_stats'
+        )
+        count = copy_rows(cursor, 'ratings', [
+            'creator_id', 'receiver_id', 'rating_value', 'improve'
+        ], generate_ratings(
+            first_id, args.users, args.ratings_per_user, args.alpha
+        ))
+        cursor.execute(
+            'ALTER TABLE ratings ENABLE TRIGGER '
+            'ratings_update_user_rating_stats'
+        )
+        cursor.execute(str(rating_stats_backfill_ddl.statement))
+        print(f'ratings: {count} in {time.perf_counter() - start:.1f}s')
+
+        cursor.execute('ANALYZE')
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--ratings-per-user', type=float, default=5)
+    parser.add_argument('--max-friends', type=int, default=5000)
+    parser.add_argument(
+        '--alpha', type=float, default=1.5,
+        help='power law exponent of friendship and ratings degrees'
+    )
+    parser.add_argument('--password', default=SEED_PASSWORD)
+    parser.add_argument('--random-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.random_seed)
+    engine = create_engine(DSN.format(**config['postgres']))
+    create_tables(engine)
+    seed(engine, args)
+
+
+if __name__ == '__main__':
+    main()
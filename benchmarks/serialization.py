@@ -0,0 +1,67 @@
+"""
+Microbenchmark of users list serialization: the old pydantic round trip
+with stdlib json and the trusted rows path with ratingsite.encoders.
+Rows are generated, so it doesn't need a database:
+
+    python -m benchmarks.serialization
+"""
+import json
+import timeit
+
+from ratingsite.encoders import dumps, orjson
+from users.serializers import UserSerializer
+
+
+# Rows count returned by an endpoint in one response
+ENDPOINTS = {
+    'users page (limit=500)': 500,
+    'users stream chunk': 1000,
+    'friends page': 20,
+    'search page': 20,
+}
+
+USER_KEYS = ('id', 'nickname', 'first_name', 'last_name', 'is_superuser')
+
+FULL_USER_KEYS = USER_KEYS + ('email', 'password', 'disabled')
+
+
+def generate_rows(count: int, keys: tuple) -> list[tuple]:
+    values = {
+        'id': 0, 'nickname': 'nickname', 'first_name': 'First',
+        'last_name': 'Last', 'is_superuser': False, 'email': 'a@b.com',
+        'password': '$pbkdf2-sha256$29000$' + 'x' * 64, 'disabled': False,
+    }
+    return [
+        tuple(i if key == 'id' else values[key] for key in keys)
+        for i in range(count)
+    ]
+
+
+def old_serialize(rows: list[tuple]) -> bytes:
+    users = [
+        UserSerializer.parse_obj(dict(zip(FULL_USER_KEYS, row))).dict()
+        for row in rows
+    ]
+    return json.dumps(users).encode()
+
+
+def new_serialize(rows: list[tuple]) -> bytes:
+    return dumps([dict(zip(USER_KEYS, row)) for row in rows])
+
+
+def main():
+    print(f'encoder: {"orjson" if orjson else "json"}')
+    for endpoint, count in ENDPOINTS.items():
+        full_rows = generate_rows(count, FULL_USER_KEYS)
+        rows = generate_rows(count, USER_KEYS)
+        number = max(1, 20000 // count)
+        old = timeit.timeit(lambda: old_serialize(full_rows), number=number)
+        new = timeit.timeit(lambda: new_serialize(rows), number=number)
+        print(
+            f'{endpoint}: old {old / number * 1e6:.1f}us, '
+            f'new {new / number * 1e6:.1f}us, x{old / new:.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Measure the app cold start: importing main and creating the app in a new
+interpreter, and print the slowest imports from `-X importtime`. Run from
+the project root:
+
+    python -m benchmarks.startup --runs 5 --max-seconds 1.0
+
+Exits with status 1 if the median startup time is over `--max-seconds`,
+so it can be used as a startup time check before deployment
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+STARTUP_CODE = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app(main.config)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def run_startup() -> tuple[float, float]:
+    """Get import and create_app durations in a new interpreter"""
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_CODE], capture_output=True,
+        text=True, check=True, env=dict(os.environ, PYTHONPATH='.')
+    ).stdout
+    import_duration, create_duration = map(float, output.split())
+    return import_duration, create_duration
+
+
+def get_slowest_imports(count: int) -> list[tuple[int, str]]:
+    """Get cumulative time in microseconds and names of slowest imports"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONPATH='.')
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'): continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit(): continue
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    print('Slowest imports (cumulative ms):')
+    for cumulative, name in get_slowest_imports(args.top):
+        print(f'{cumulative / 1000:>10.1f} {name}')
+
+    durations = [run_startup() for _ in range(args.runs)]
+    import_median = statistics.median(d[0] for d in durations)
+    create_median = statistics.median(d[1] for d in durations)
+    total_median = statistics.median(sum(d) for d in durations)
+    print(
+        f'\nimport main: {import_median:.3f}s, '
+        f'create_app: {create_median:.3f}s, total: {total_median:.3f}s '
+        f'(median of {args.runs})'
+    )
+    if args.max_seconds is not None and total_median > args.max_seconds:
+        sys.exit(
+            f'Startup {total_median:.3f}s is over {args.max_seconds}s'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,34 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, text
 
 from ratingsite.settings import config
 from users.db import users, users_friends_association
-from ratings.db import ratings
+from ratings.db import (
+    ratings, user_rating_stats, rating_stats_ddl, ratings_deduplicate_ddl
+)
 
 
 DSN = "postgresql://{user}:{password}@{host}:{port}/{database}"
 
 
+def create_extensions(engine):
+    with engine.begin() as conn:
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+
 def create_tables(engine):
+    create_extensions(engine)
     meta = MetaData()
-    meta.create_all(bind=engine, tables=[
-        users_friends_association, users, ratings
-    ])
+    tables = [users_friends_association, users, ratings, user_rating_stats]
+    meta.create_all(bind=engine, tables=tables)
+    with engine.begin() as conn:
+        conn.execute(ratings_deduplicate_ddl)
+    # create_all skips indexes of already existing tables
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        for ddl in rating_stats_ddl:
+            conn.execute(ddl)
 
 
 if __name__ == '__main__':
@@ -2,20 +2,62 @@ from aiohttp import web
 from aiohttp.web_middlewares import normalize_path_middleware
 from aiohttp_security import JWTIdentityPolicy, setup as setup_secure
 
+from ratingsite.cache import LRUCache, response_cache_context
+from ratingsite.compression import (
+    create_compression_middleware, get_compression_conf
+)
 from ratingsite.routes import setup_routes
 from ratingsite.settings import config
 from ratingsite.db import pg_context
+from ratingsite.ratelimit import rate_limit_context, rate_limit_middleware
+from ratingsite.tracing import create_tracing_middleware
+from ratingsite.workers import run
+from ratingsite.writebehind import write_behind_context
+from ratings.leaderboard import leaderboard_context
 from users.authorization import IsAuthenticatedAuthorizationPolicy
-from users.middlewares import authentication_middleware
+from users.graph import friendship_graph_context
+from users.middlewares import (
+    authentication_middleware, is_request_superuser
+)
+from users.passwords import password_hasher_context
+from users.search import nickname_trie_context
+from users.services import login_cache_context
 
 
-app = web.Application()
-app.middlewares.extend([
-    authentication_middleware, normalize_path_middleware()
-])
-id_policy = JWTIdentityPolicy(config['jwt_secret'])
-setup_secure(app, id_policy, IsAuthenticatedAuthorizationPolicy())
-app['config'] = config
-setup_routes(app)
-app.cleanup_ctx.append(pg_context)
-web.run_app(app)
+def create_app(config: dict) -> web.Application:
+    app = web.Application()
+    if config.get('tracing', {}).get('enabled'):
+        app.middlewares.append(
+            create_tracing_middleware(is_request_superuser)
+        )
+    compression_conf = get_compression_conf(config)
+    if compression_conf['enabled']:
+        app.middlewares.append(
+            create_compression_middleware(compression_conf)
+        )
+    app.middlewares.extend([
+        rate_limit_middleware, authentication_middleware,
+        normalize_path_middleware()
+    ])
+    id_policy = JWTIdentityPolicy(config['jwt_secret'])
+    setup_secure(app, id_policy, IsAuthenticatedAuthorizationPolicy())
+    app['config'] = config
+    app['identity_cache'] = LRUCache(**config.get('identity_cache', {
+        'maxsize': 10000, 'ttl': 300
+    }))
+    app['login_cache'] = LRUCache(**config.get('login_cache', {
+        'maxsize': 10000, 'ttl': 60
+    }))
+    setup_routes(app)
+    # Contexts are cleaned up in reverse order, so the write-behind queue
+    # is flushed while the database and other contexts are available
+    app.cleanup_ctx.extend([
+        pg_context, login_cache_context, nickname_trie_context,
+        password_hasher_context, response_cache_context, leaderboard_context,
+        friendship_graph_context, rate_limit_context, write_behind_context
+    ])
+    return app
+
+
+if __name__ == '__main__':
+    run(create_app, config)
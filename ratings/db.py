@@ -1,9 +1,24 @@
 from sqlalchemy import (
-    MetaData, Table, Column, ForeignKey, Integer, String, CheckConstraint
+    Table, Column, ForeignKey, Integer, BigInteger, String, CheckConstraint,
+    Index, DDL
 )
+from sqlalchemy.dialects.postgresql import ARRAY
 
+# Ratings reference users, so they have to be in the same metadata for the
+# foreign keys to be resolved
+from users.db import meta
 
-meta = MetaData()
+
+RATING_MIN_VALUE = -1000
+
+RATING_MAX_VALUE = 1000
+
+RATING_IMPROVE_MAX_LENGTH = 100
+
+RATING_HISTOGRAM_BUCKETS = 20
+
+# Channel notified with user id on every change of the user rating stats
+RATING_STATS_CHANNEL = 'user_rating_stats'
 
 ratings = Table(
     'ratings', meta,
@@ -12,7 +27,122 @@ ratings = Table(
     Column('creator_id', ForeignKey('users.id', ondelete='CASCADE')),
     Column('receiver_id', ForeignKey('users.id', ondelete='CASCADE')),
     Column('rating_value', Integer),
-    Column('improve', String(100)),
+    Column('improve', String(RATING_IMPROVE_MAX_LENGTH)),
 
     CheckConstraint('rating_value >= -1000 AND rating_value <= 1000'),
+    # One rating per creator and receiver, it's the conflict target of
+    # ratings upserts
+    Index(
+        'ix_ratings_creator_id_receiver_id', 'creator_id', 'receiver_id',
+        unique=True
+    ),
+)
+
+# Executed by init_db before indexes creation: keep only the latest rating
+# of every creator and receiver, so the unique index can be created
+ratings_deduplicate_ddl = DDL("""
+DELETE FROM ratings AS old USING ratings AS new
+WHERE old.creator_id = new.creator_id
+  AND old.receiver_id = new.receiver_id
+  AND old.id < new.id
+""")
+
+# Aggregates of ratings received by the user, maintained by the trigger on
+# ratings. ratings_sum is the user score in the leaderboard. histogram[i]
+# is the number of ratings in the i-th of 20 equal buckets of -1000..1000
+# range (the last bucket includes 1000)
+user_rating_stats = Table(
+    'user_rating_stats', meta,
+
+    Column(
+        'user_id', ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    Column('ratings_count', Integer, nullable=False),
+    Column('ratings_sum', BigInteger, nullable=False),
+    Column('histogram', ARRAY(Integer), nullable=False),
 )
+
+# Backfill stats of users without stats (their ratings were created before
+# the trigger or with the trigger disabled)
+rating_stats_backfill_ddl = DDL(f"""
+WITH buckets AS (
+    SELECT receiver_id, rating_histogram_bucket(rating_value) AS bucket,
+           count(*) AS bucket_count, sum(rating_value) AS bucket_sum
+    FROM ratings
+    WHERE receiver_id IS NOT NULL AND rating_value IS NOT NULL
+    GROUP BY 1, 2
+)
+INSERT INTO user_rating_stats (user_id, ratings_count, ratings_sum, histogram)
+SELECT receivers.receiver_id, sum(buckets.bucket_count),
+       sum(buckets.bucket_sum),
+       array_agg(coalesce(buckets.bucket_count, 0) ORDER BY series.bucket)
+FROM (SELECT DISTINCT receiver_id FROM buckets) AS receivers
+CROSS JOIN generate_series(1, {RATING_HISTOGRAM_BUCKETS}) AS series(bucket)
+LEFT JOIN buckets ON buckets.receiver_id = receivers.receiver_id
+                 AND buckets.bucket = series.bucket
+GROUP BY receivers.receiver_id
+ON CONFLICT (user_id) DO NOTHING
+""")
+
+# Idempotent DDL executed by init_db after tables creation
+rating_stats_ddl = [
+    DDL(f"""
+CREATE OR REPLACE FUNCTION rating_histogram_bucket(value integer)
+RETURNS integer AS $$
+    SELECT LEAST(
+        (value - {RATING_MIN_VALUE}) * {RATING_HISTOGRAM_BUCKETS}
+            / ({RATING_MAX_VALUE} - {RATING_MIN_VALUE}),
+        {RATING_HISTOGRAM_BUCKETS} - 1
+    ) + 1
+$$ LANGUAGE SQL IMMUTABLE
+"""),
+    DDL(f"""
+CREATE OR REPLACE FUNCTION update_user_rating_stats()
+RETURNS trigger AS $$
+DECLARE
+    bucket integer;
+    new_histogram integer[];
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE')
+            AND OLD.receiver_id IS NOT NULL
+            AND OLD.rating_value IS NOT NULL THEN
+        bucket := rating_histogram_bucket(OLD.rating_value);
+        UPDATE user_rating_stats SET
+            ratings_count = ratings_count - 1,
+            ratings_sum = ratings_sum - OLD.rating_value,
+            histogram[bucket] = histogram[bucket] - 1
+        WHERE user_id = OLD.receiver_id;
+        PERFORM pg_notify(
+            '{RATING_STATS_CHANNEL}', OLD.receiver_id::text
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE')
+            AND NEW.receiver_id IS NOT NULL
+            AND NEW.rating_value IS NOT NULL THEN
+        bucket := rating_histogram_bucket(NEW.rating_value);
+        new_histogram := array_fill(0, ARRAY[{RATING_HISTOGRAM_BUCKETS}]);
+        new_histogram[bucket] := 1;
+        INSERT INTO user_rating_stats AS stats
+            (user_id, ratings_count, ratings_sum, histogram)
+        VALUES (NEW.receiver_id, 1, NEW.rating_value, new_histogram)
+        ON CONFLICT (user_id) DO UPDATE SET
+            ratings_count = stats.ratings_count + 1,
+            ratings_sum = stats.ratings_sum + NEW.rating_value,
+            histogram[bucket] = stats.histogram[bucket] + 1;
+        PERFORM pg_notify(
+            '{RATING_STATS_CHANNEL}', NEW.receiver_id::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""),
+    DDL("DROP TRIGGER IF EXISTS ratings_update_user_rating_stats ON ratings"),
+    DDL("""
+CREATE TRIGGER ratings_update_user_rating_stats
+AFTER INSERT OR UPDATE OR DELETE ON ratings
+FOR EACH ROW EXECUTE FUNCTION update_user_rating_stats()
+"""),
+    rating_stats_backfill_ddl,
+]
@@ -0,0 +1,131 @@
+from typing import Optional
+
+from sortedcontainers import SortedList
+
+from ratingsite.notifications import NotificationListener
+from .db import user_rating_stats, RATING_STATS_CHANNEL
+
+
+LOAD_CHUNK_SIZE = 10000
+
+
+class Leaderboard:
+    """
+    In-process order statistic index of users scores (sum of received
+    ratings). Users are ordered by score descending, then by id, rank and
+    keyset page lookups are O(log n)
+    """
+
+    def __init__(self) -> None:
+        self._entries = SortedList()
+        self._scores = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def reset(self, scores: dict[int, int]) -> None:
+        """Replace all scores"""
+        self._scores = dict(scores)
+        self._entries = SortedList(
+            (-score, user_id) for user_id, score in self._scores.items()
+        )
+
+    def set_score(self, user_id: int, score: Optional[int]) -> None:
+        """Set the user score, None removes the user from the leaderboard"""
+        old_score = self._scores.pop(user_id, None)
+        if old_score is not None:
+            self._entries.remove((-old_score, user_id))
+        if score is not None:
+            self._scores[user_id] = score
+            self._entries.add((-score, user_id))
+
+    def get_score(self, user_id: int) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def get_rank(self, user_id: int) -> Optional[int]:
+        """Get 1-based user rank or None if the user has no ratings"""
+        score = self._scores.get(user_id)
+        if score is None: return None
+        return self._entries.index((-score, user_id)) + 1
+
+    def get_page(self, limit: int, after_score: Optional[int] = None,
+            after_id: Optional[int] = None) -> list[tuple[int, int, int]]:
+        """
+        Get up to `limit` (rank, user_id, score) entries after the entry
+        with `after_score` and `after_id` (from the top if they are None)
+        """
+        start = 0
+        if after_score is not None and after_id is not None:
+            start = self._entries.bisect_right((-after_score, after_id))
+        return [
+            (start + index + 1, user_id, -negative_score)
+            for index, (negative_score, user_id) in enumerate(
+                self._entries.islice(start, start + limit)
+            )
+        ]
+
+
+async def load_scores(conn, user_ids: Optional[list[int]] = None
+        ) -> dict[int, int]:
+    """
+    Load scores of users with `user_ids` or all scores chunk by chunk if
+    `user_ids` is None
+    """
+    stats = user_rating_stats.c
+    query = user_rating_stats.select().with_only_columns([
+        stats.user_id, stats.ratings_sum
+    ])
+    if user_ids is not None:
+        cursor = await conn.execute(query.where(stats.user_id.in_(user_ids)))
+        rows = await cursor.fetchall()
+        return {row.user_id: row.ratings_sum for row in rows}
+
+    scores = {}
+    after_id = 0
+    while True:
+        cursor = await conn.execute(query.where(
+            stats.user_id > after_id
+        ).order_by(stats.user_id).limit(LOAD_CHUNK_SIZE))
+        chunk = await cursor.fetchall()
+        scores.update((row.user_id, row.ratings_sum) for row in chunk)
+        if len(chunk) < LOAD_CHUNK_SIZE: return scores
+        after_id = chunk[-1].user_id
+
+
+async def _update_scores(leaderboard: Leaderboard, engine,
+        payloads: list[str]) -> None:
+    """Reload scores of the users notified by the stats trigger"""
+    user_ids = {int(payload) for payload in payloads}
+    async with engine.acquire() as conn:
+        scores = await load_scores(conn, list(user_ids))
+    for user_id in user_ids:
+        leaderboard.set_score(user_id, scores.get(user_id))
+
+
+async def leaderboard_context(app):
+    conf = app['config'].get('leaderboard', {})
+    app['leaderboard'] = None
+    if not conf.get('enabled', True):
+        yield
+        return
+
+    # Scores written by other workers are reloaded with one query per
+    # batch of the stats trigger notifications
+    leaderboard = Leaderboard()
+    engine = app['db']
+
+    async def load(conn) -> None:
+        leaderboard.reset(await load_scores(conn))
+
+    async def handle(payloads: list[str]) -> None:
+        await _update_scores(leaderboard, engine, payloads)
+
+    listener = NotificationListener(
+        engine, app['config']['postgres'], RATING_STATS_CHANNEL, load, handle
+    )
+    await listener.start()
+    app['leaderboard'] = leaderboard
+
+    yield
+
+    await listener.close()
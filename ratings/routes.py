@@ -1,4 +1,15 @@
 from aiohttp import web
 
+from . import views
 
-routes = []
+
+routes = [
+    web.post('/api/v1/ratings/', views.create_rating),
+    web.post('/api/v1/ratings/bulk/', views.bulk_import_ratings),
+    web.put(r'/api/v1/ratings/{receiver_id:\d+}/', views.update_rating),
+    web.get('/api/v1/ratings/leaderboard/', views.leaderboard),
+    web.get(
+        '/api/v1/ratings/leaderboard/{user_nickname}/',
+        views.user_leaderboard_rank
+    ),
+]
@@ -1,4 +1,11 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, conint, constr, validator
+
+from .db import RATING_MIN_VALUE, RATING_MAX_VALUE, RATING_IMPROVE_MAX_LENGTH
+
+
+RATINGS_BULK_MAX_SIZE = 10000
 
 
 class RatingSerializer(BaseModel):
@@ -6,3 +13,49 @@ class RatingSerializer(BaseModel):
 
     rating_value: int
     improve: str
+
+
+class RatingStatsSerializer(BaseModel):
+    """PyDantic model for aggregate ratings of user"""
+
+    count: int
+    sum: int
+    mean: Optional[float]
+    histogram: list[int]
+
+
+class RatingData(BaseModel):
+    """PyDantic model for rating data"""
+
+    rating_value: conint(ge=RATING_MIN_VALUE, le=RATING_MAX_VALUE)
+    improve: constr(max_length=RATING_IMPROVE_MAX_LENGTH) = ''
+
+
+class CreateRatingData(RatingData):
+    """PyDantic model for rating data with receiver"""
+
+    receiver_id: int
+
+
+class BulkRatingData(CreateRatingData):
+    """PyDantic model for imported rating data with creator"""
+
+    creator_id: int
+
+
+class BulkRatingsData(BaseModel):
+    """PyDantic model for bulk ratings import data"""
+
+    ratings: list[BulkRatingData]
+
+    @validator('ratings')
+    def validate_ratings_count(cls,
+            value: list[BulkRatingData]) -> list[BulkRatingData]:
+        """Validate is there 1 <= ratings count <= RATINGS_BULK_MAX_SIZE"""
+        if not 0 < len(value) <= RATINGS_BULK_MAX_SIZE:
+            raise ValueError(
+                f'Ratings count should be between 1 and '
+                f'{RATINGS_BULK_MAX_SIZE}'
+            )
+
+        return value
@@ -1,9 +1,40 @@
 from typing import Union, Optional
 
-from sqlalchemy import and_
+from sqlalchemy import and_, select, func, cast, Float, literal_column
+from sqlalchemy.dialects.postgresql import insert
 
-from .db import ratings
-from .serializers import RatingSerializer
+from ratingsite.db import fetch_dicts
+from ratingsite.metrics import timed
+from users.db import users
+from .db import ratings, user_rating_stats, RATING_HISTOGRAM_BUCKETS
+from .leaderboard import Leaderboard
+from .serializers import (
+    RatingSerializer, RatingStatsSerializer, RatingData, BulkRatingData
+)
+
+
+def get_empty_rating_stats() -> dict:
+    """Get rating stats of user without ratings"""
+    return RatingStatsSerializer(
+        count=0, sum=0, mean=None, histogram=[0] * RATING_HISTOGRAM_BUCKETS
+    ).dict()
+
+
+def rating_stats_json(user_id):
+    """
+    Construct subquery with json object of the user rating stats, `user_id`
+    can be a column of the outer query. It's a primary key lookup of
+    precomputed stats, no aggregation over ratings
+    """
+    stats = user_rating_stats.c
+    return select(func.json_build_object(
+        'count', stats.ratings_count,
+        'sum', stats.ratings_sum,
+        'mean', cast(stats.ratings_sum, Float) / func.nullif(
+            stats.ratings_count, 0
+        ),
+        'histogram', stats.histogram
+    )).where(stats.user_id == user_id).scalar_subquery()
 
 
 class GetUserRatingService:
@@ -22,6 +53,7 @@ class GetUserRatingService:
         rating = await cursor.fetchone()
         return rating
 
+    @timed
     async def get_user_rating(self,
             another_user_id: int) -> Optional[dict]:
         """Get rating for user"""
@@ -29,3 +61,141 @@ class GetUserRatingService:
         rating = await self._get_rating(another_user_id)
         if not rating: return None
         return RatingSerializer.parse_obj(dict(rating)).dict()
+
+
+RATINGS_BULK_CHUNK_SIZE = 1000
+
+
+def _upsert_ratings_query(values: list[dict]):
+    """
+    Construct multi-row insert of ratings updating value and improve of
+    existing ratings with the same creator and receiver. Returns ratings
+    with receivers nicknames (for responses cache invalidation)
+    """
+    query = insert(ratings).values(values)
+    # RETURNING isn't a FROM clause to correlate with, so the inserted row
+    # column is referenced literally
+    receiver_nickname = select(users.c.nickname).where(
+        users.c.id == literal_column('ratings.receiver_id')
+    ).scalar_subquery()
+    return query.on_conflict_do_update(
+        index_elements=[ratings.c.creator_id, ratings.c.receiver_id],
+        set_={
+            'rating_value': query.excluded.rating_value,
+            'improve': query.excluded.improve,
+        }
+    ).returning(
+        ratings.c.receiver_id, ratings.c.rating_value, ratings.c.improve,
+        receiver_nickname.label('receiver_nickname')
+    )
+
+
+class RateUserService:
+    """Service to create or update ratings of the current user"""
+
+    def __init__(self, conn, current_user_id: int) -> None:
+        self._conn = conn
+        self._current_user_id = current_user_id
+
+    @timed
+    async def rate_user(self, receiver_id: int,
+            rating_data: RatingData) -> dict:
+        """
+        Create or update the current user rating of the receiver, return
+        the rating with the receiver nickname. Raise ValueError if the user
+        rates himself
+        """
+        if receiver_id == self._current_user_id: raise ValueError
+        query = _upsert_ratings_query([{
+            'creator_id': self._current_user_id, 'receiver_id': receiver_id,
+            **rating_data.dict(include={'rating_value', 'improve'})
+        }])
+        cursor = await self._conn.execute(query)
+        return (await fetch_dicts(cursor))[0]
+
+
+@timed
+async def import_ratings(conn, ratings_data: list[BulkRatingData]) -> tuple:
+    """
+    Create or update ratings with multi-row upserts of
+    RATINGS_BULK_CHUNK_SIZE ratings in one transaction. If there are
+    several ratings with the same creator and receiver the last one is
+    imported, ratings of creators to themselves are skipped. Return the
+    import result and the set of receivers nicknames
+    """
+    values = {}
+    for rating in ratings_data:
+        if rating.creator_id == rating.receiver_id: continue
+        values[rating.creator_id, rating.receiver_id] = rating.dict()
+    values = list(values.values())
+
+    receivers_nicknames = set()
+    async with conn.begin():
+        for start in range(0, len(values), RATINGS_BULK_CHUNK_SIZE):
+            query = _upsert_ratings_query(
+                values[start:start + RATINGS_BULK_CHUNK_SIZE]
+            )
+            cursor = await conn.execute(query)
+            receivers_nicknames.update(
+                rating['receiver_nickname']
+                for rating in await fetch_dicts(cursor)
+            )
+
+    result = {
+        'imported': len(values), 'skipped': len(ratings_data) - len(values)
+    }
+    return result, receivers_nicknames
+
+
+LEADERBOARD_DEFAULT_LIMIT = 50
+
+LEADERBOARD_MAX_LIMIT = 500
+
+
+class GetLeaderboardService:
+    """Service to get top rated users and users ranks"""
+
+    def __init__(self, conn, leaderboard: Leaderboard) -> None:
+        self._conn = conn
+        self._leaderboard = leaderboard
+
+    async def _get_users_by_ids(self, user_ids: list[int]) -> dict:
+        """Get users (public fields) by ids as dict by id"""
+        if not user_ids: return {}
+        query = select([
+            users.c.id, users.c.nickname, users.c.first_name,
+            users.c.last_name, users.c.is_superuser
+        ]).where(users.c.id.in_(user_ids))
+        cursor = await self._conn.execute(query)
+        return {user['id']: user for user in await fetch_dicts(cursor)}
+
+    @timed
+    async def get_page(self, limit: int = LEADERBOARD_DEFAULT_LIMIT,
+            after_score: Optional[int] = None,
+            after_id: Optional[int] = None) -> list[dict]:
+        """
+        Get page of users ordered by score (sum of received ratings)
+        starting after the user with `after_score` and `after_id`
+        """
+        entries = self._leaderboard.get_page(limit, after_score, after_id)
+        users_by_id = await self._get_users_by_ids([
+            user_id for _, user_id, _ in entries
+        ])
+        return [
+            {'rank': rank, 'score': score, 'user': users_by_id[user_id]}
+            for rank, user_id, score in entries if user_id in users_by_id
+        ]
+
+    @timed
+    async def get_user_rank(self, user_nickname: str) -> dict:
+        """
+        Get the user rank and score (None if the user has no ratings),
+        raise IndexError if there is no user with this nickname
+        """
+        query = select([users.c.id]).where(users.c.nickname == user_nickname)
+        user_id = await self._conn.scalar(query)
+        if user_id is None: raise IndexError
+        return {
+            'rank': self._leaderboard.get_rank(user_id),
+            'score': self._leaderboard.get_score(user_id),
+        }
@@ -0,0 +1,229 @@
+from functools import wraps
+
+from psycopg2.errors import ForeignKeyViolation
+from pydantic import ValidationError
+
+from ratingsite.db import get_read_db, remember_writes
+from ratingsite.encoders import json_response
+from ratingsite.tracing import trace_span
+from users.middlewares import skip_authentication
+from users.services import is_superuser
+from users.views import user_required
+from .serializers import RatingData, CreateRatingData, BulkRatingsData
+from .services import (
+    GetLeaderboardService, RateUserService, import_ratings,
+    LEADERBOARD_DEFAULT_LIMIT, LEADERBOARD_MAX_LIMIT
+)
+
+
+def leaderboard_required(func):
+
+    @wraps(func)
+    def wrapper(request):
+        if request.app['leaderboard'] is None:
+            return json_response(
+                {'error': 'Leaderboard is disabled'}, status=503
+            )
+
+        return func(request)
+
+    return wrapper
+
+
+def _get_leaderboard_params(request) -> tuple:
+    """
+    Get `limit`, `after_score` and `after_id` query params, raise
+    ValueError if they are incorrect
+    """
+    limit = int(request.query.get('limit', LEADERBOARD_DEFAULT_LIMIT))
+    after_score = request.query.get('after_score')
+    after_id = request.query.get('after_id')
+    if not 0 < limit <= LEADERBOARD_MAX_LIMIT:
+        raise ValueError
+    if (after_score is None) != (after_id is None):
+        raise ValueError
+    if after_score is not None:
+        after_score, after_id = int(after_score), int(after_id)
+    return limit, after_score, after_id
+
+
+@skip_authentication
+@leaderboard_required
+async def leaderboard(request):
+    """
+    ---
+    description: Return users ordered by score (sum of received ratings)
+    tags:
+    - ratings
+    parameters:
+    - in: query
+      name: limit
+      type: integer
+    - in: query
+      name: after_score
+      type: integer
+      description: score of the last user of the previous page
+    - in: query
+      name: after_id
+      type: integer
+      description: id of the last user of the previous page
+    responses:
+        "200":
+            description: successful operation
+        "400":
+            description: incorrect query parameters
+    """
+    try:
+        limit, after_score, after_id = _get_leaderboard_params(request)
+    except ValueError:
+        return json_response({
+            'error': f'after_score and after_id should be integers passed '
+                     f'together, 0 < limit <= {LEADERBOARD_MAX_LIMIT}'
+        }, status=400)
+
+    async with get_read_db(request).acquire() as conn:
+        service = GetLeaderboardService(conn, request.app['leaderboard'])
+        entries = await service.get_page(limit, after_score, after_id)
+
+    response = json_response(entries)
+    if len(entries) == limit:
+        response.headers['X-Next-After-Score'] = str(entries[-1]['score'])
+        response.headers['X-Next-After-Id'] = str(entries[-1]['user']['id'])
+    return response
+
+
+@skip_authentication
+@leaderboard_required
+async def user_leaderboard_rank(request):
+    """
+    ---
+    description: Return the user rank and score in the leaderboard
+    tags:
+    - ratings
+    responses:
+        "200":
+            description: successful operation
+        "400":
+            description: there is no user with this nickname
+    """
+    user_nickname = request.match_info['user_nickname']
+    async with get_read_db(request, user_nickname).acquire() as conn:
+        service = GetLeaderboardService(conn, request.app['leaderboard'])
+        try:
+            rank = await service.get_user_rank(user_nickname)
+        except IndexError:
+            return json_response({
+                'error': 'There is no user with this nickname'
+            }, status=400)
+
+    return json_response(rank)
+
+
+async def _rate_user(request, receiver_id: int, rating_data: RatingData):
+    async with request.app['db'].acquire() as conn:
+        service = RateUserService(conn, request.user['id'])
+        try:
+            rating = await service.rate_user(receiver_id, rating_data)
+        except ValueError:
+            return json_response(
+                {'error': "You can't rate yourself"}, status=400
+            )
+        except ForeignKeyViolation:
+            return json_response(
+                {'error': "User with this ID doesn't exist"}, status=400
+            )
+
+    receiver_nickname = rating.pop('receiver_nickname')
+    await request.app['response_cache'].invalidate(receiver_nickname)
+    remember_writes(
+        request.app, request.user['nickname'], receiver_nickname
+    )
+    return json_response(rating)
+
+
+@user_required
+async def create_rating(request):
+    """
+    ---
+    description: Rate the user, update the rating if it already exists
+    tags:
+    - ratings
+    responses:
+        "200":
+            description: successful operation
+        "400":
+            description: incorrect rating data or unknown user
+    """
+    request_body = await request.text()
+    try:
+        with trace_span('validation'):
+            rating_data = CreateRatingData.parse_raw(request_body)
+    except ValidationError as e:
+        return json_response(e.json(), status=400)
+
+    return await _rate_user(request, rating_data.receiver_id, rating_data)
+
+
+@user_required
+async def update_rating(request):
+    """
+    ---
+    description: Update the rating of the user, create it if it doesn't exist
+    tags:
+    - ratings
+    responses:
+        "200":
+            description: successful operation
+        "400":
+            description: incorrect rating data or unknown user
+    """
+    receiver_id = int(request.match_info['receiver_id'])
+    request_body = await request.text()
+    try:
+        with trace_span('validation'):
+            rating_data = RatingData.parse_raw(request_body)
+    except ValidationError as e:
+        return json_response(e.json(), status=400)
+
+    return await _rate_user(request, receiver_id, rating_data)
+
+
+@user_required
+async def bulk_import_ratings(request):
+    """
+    ---
+    description: Create or update ratings of any users (superusers only)
+    tags:
+    - ratings
+    responses:
+        "200":
+            description: number of imported and skipped ratings
+        "400":
+            description: incorrect ratings data or unknown user
+        "403":
+            description: the user isn't a superuser
+    """
+    request_body = await request.text()
+    try:
+        with trace_span('validation'):
+            ratings_data = BulkRatingsData.parse_raw(request_body)
+    except ValidationError as e:
+        return json_response(e.json(), status=400)
+
+    async with request.app['db'].acquire() as conn:
+        if not await is_superuser(conn, request.user['id']):
+            return json_response({'error': 'Permission denied'}, status=403)
+        try:
+            result, receivers_nicknames = await import_ratings(
+                conn, ratings_data.ratings
+            )
+        except ForeignKeyViolation:
+            return json_response(
+                {'error': "User with this ID doesn't exist"}, status=400
+            )
+
+    await request.app['response_cache'].invalidate(*receivers_nicknames)
+    remember_writes(
+        request.app, request.user['nickname'], *receivers_nicknames
+    )
+    return json_response(result)
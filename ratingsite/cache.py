@@ -0,0 +1,259 @@
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiohttp import hdrs
+from aiohttp.web import Response
+from sqlalchemy import text
+
+from .encoders import dumps
+from .notifications import NotificationListener
+from .workers import get_workers_count
+
+
+# Headers which are set by aiohttp for every response
+CACHE_SKIPPED_HEADERS = {hdrs.CONTENT_TYPE, hdrs.CONTENT_LENGTH}
+
+# Channel of user keys notifications about invalidated responses
+RESPONSE_CACHE_CHANNEL = 'response_cache'
+
+INVALIDATION_NOTIFY_QUERY = text(
+    'SELECT pg_notify(:channel, user_key) '
+    'FROM unnest(CAST(:user_keys AS text[])) AS user_key'
+)
+
+
+class LRUCache:
+    """
+    In-process LRU cache with at most `maxsize` entries. Entries expire
+    after `ttl` seconds or at the `expires_at` timestamp passed on set
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get not expired value by key and mark it as recently used"""
+        entry = self._entries.get(key)
+        if entry is None: return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any,
+            expires_at: Optional[float] = None) -> None:
+        """
+        Set value by key. The entry expires at the nearest of `expires_at`
+        and now + ttl
+        """
+        if self._ttl is not None:
+            ttl_expires_at = time.time() + self._ttl
+            if expires_at is None or ttl_expires_at < expires_at:
+                expires_at = ttl_expires_at
+
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Delete the entry by key if it exists"""
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Delete all entries"""
+        self._entries.clear()
+
+
+class MemoryCacheBackend:
+    """Response cache backend storing values in in-process LRUCache"""
+
+    def __init__(self, maxsize: int) -> None:
+        self._cache = LRUCache(maxsize)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._cache.set(key, value, time.time() + ttl)
+
+    async def clear(self) -> None:
+        self._cache.clear()
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+
+class RedisCacheBackend:
+    """
+    Response cache backend storing values in Redis. `client` is
+    redis.asyncio.Redis or any object with the same async get, set and
+    close methods
+    """
+
+    def __init__(self, client) -> None:
+        self._client = client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(key, value, ex=max(1, int(ttl)))
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+class ResponseCache:
+    """
+    Read-through cache of JSON responses related to a user (profile,
+    friends). Every user has a generation in the cache which is a part of
+    all keys of the user responses, so all of them are invalidated by
+    setting a new generation. Responses are returned with ETag and
+    If-None-Match requests get 304 without a body. If `engine` is passed,
+    invalidations are also sent to other worker processes with
+    notifications, their caches call `invalidate_local`
+    """
+
+    def __init__(self, backend, ttl: float, engine=None) -> None:
+        self._backend = backend
+        self._ttl = ttl
+        self._engine = engine
+
+    @staticmethod
+    def _new_generation() -> bytes:
+        return uuid.uuid4().hex.encode()
+
+    async def _get_generation(self, user_key: str) -> bytes:
+        """
+        Get generation of the user responses. If there is no generation
+        (it's new or evicted) the new unique one is set, so responses
+        cached with the previous generation can't be returned
+        """
+        generation_key = f'generation:{user_key}'
+        generation = await self._backend.get(generation_key)
+        if generation is None:
+            generation = self._new_generation()
+            await self._backend.set(generation_key, generation, self._ttl)
+        return generation
+
+    async def invalidate_local(self, *user_keys: str) -> None:
+        """Invalidate cached responses of the users in this cache only"""
+        for user_key in user_keys:
+            await self._backend.set(
+                f'generation:{user_key}', self._new_generation(), self._ttl
+            )
+
+    async def invalidate(self, *user_keys: str) -> None:
+        """Invalidate all cached responses of the users"""
+        await self.invalidate_local(*user_keys)
+        if self._engine is None or not user_keys: return
+        async with self._engine.acquire() as conn:
+            await conn.execute(
+                INVALIDATION_NOTIFY_QUERY, channel=RESPONSE_CACHE_CHANNEL,
+                user_keys=list(user_keys)
+            )
+
+    @staticmethod
+    def _pack(etag: str, response: Response) -> bytes:
+        headers = {
+            str(name): value for name, value in response.headers.items()
+            if name not in CACHE_SKIPPED_HEADERS
+        }
+        return b'\n'.join([etag.encode(), dumps(headers), response.body])
+
+    @staticmethod
+    def _unpack(value: bytes) -> tuple[str, Response]:
+        etag, headers, body = value.split(b'\n', 2)
+        response = Response(
+            body=body, headers=json.loads(headers),
+            content_type='application/json'
+        )
+        return etag.decode(), response
+
+    @staticmethod
+    def _conditional_response(request, etag: str,
+            response: Response) -> Response:
+        """
+        Return 304 if the request If-None-Match matches the ETag. Tags are
+        compared weakly, compressed responses have weak tags
+        """
+        if_none_match = request.headers.get(hdrs.IF_NONE_MATCH, '')
+        if etag in (
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        ):
+            response = Response(status=304)
+        response.headers[hdrs.ETAG] = etag
+        return response
+
+    async def get_response(self, request, user_key: str, key: str,
+            handler: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        Get cached response of the user by key or get the response from
+        the handler and cache it if it's successful
+        """
+        generation = await self._get_generation(user_key)
+        cache_key = f'response:{user_key}:{generation.decode()}:{key}'
+        cached = await self._backend.get(cache_key)
+        if cached is not None:
+            etag, response = self._unpack(cached)
+        else:
+            response = await handler()
+            if response.status != 200: return response
+            etag = f'"{hashlib.sha1(response.body).hexdigest()}"'
+            await self._backend.set(
+                cache_key, self._pack(etag, response), self._ttl
+            )
+
+        return self._conditional_response(request, etag, response)
+
+
+def create_cache_backend(conf: dict):
+    """Create memory (default) or Redis response cache backend"""
+    if conf.get('backend', 'memory') == 'redis':
+        from redis.asyncio import Redis  # optional dependency
+        return RedisCacheBackend(Redis.from_url(conf['redis_url']))
+    return MemoryCacheBackend(conf.get('maxsize', 10000))
+
+
+async def response_cache_context(app):
+    conf = app['config'].get('response_cache', {})
+    backend = create_cache_backend(conf)
+    # Memory caches of several workers are invalidated with notifications
+    listener = None
+    if (isinstance(backend, MemoryCacheBackend) and
+            get_workers_count(app['config']) > 1):
+        cache = ResponseCache(backend, conf.get('ttl', 60), app['db'])
+
+        async def load(conn) -> None:
+            # Invalidations could be missed while the listener reconnected
+            await backend.clear()
+
+        async def handle(payloads: list[str]) -> None:
+            await cache.invalidate_local(*payloads)
+
+        listener = NotificationListener(
+            app['db'], app['config']['postgres'], RESPONSE_CACHE_CHANNEL,
+            load, handle
+        )
+        await listener.start()
+    else:
+        cache = ResponseCache(backend, conf.get('ttl', 60))
+    app['response_cache'] = cache
+
+    yield
+
+    if listener is not None: await listener.close()
+    await backend.close()
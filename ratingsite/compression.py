@@ -0,0 +1,169 @@
+import asyncio
+import gzip
+from typing import Callable, Optional
+
+from aiohttp import hdrs, web
+from aiohttp.web import ContentCoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_DEFAULTS = {
+    'enabled': True,
+    # Smaller bodies are sent as is, compression doesn't pay off for them
+    'min_size': 1024,
+    # Larger bodies are compressed in the default executor threads (the
+    # compressors release the GIL), so the event loop isn't blocked
+    'executor_min_size': 65536,
+}
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    'application/json', 'application/x-ndjson', 'text/'
+)
+
+GZIP_LEVEL = 6
+
+BROTLI_QUALITY = 4
+
+ZSTD_LEVEL = 3
+
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _get_compressors() -> dict[str, Callable[[bytes], bytes]]:
+    """Get available compressors in the order of server preference"""
+    compressors = {}
+    if zstandard is not None:
+        # ZstdCompressor objects can't be shared by executor threads
+        compressors['zstd'] = lambda body: zstandard.compress(
+            body, level=ZSTD_LEVEL
+        )
+    if brotli is not None:
+        compressors['br'] = lambda body: brotli.compress(
+            body, quality=BROTLI_QUALITY
+        )
+    compressors['gzip'] = _gzip
+    return compressors
+
+
+COMPRESSORS = _get_compressors()
+
+
+def _parse_accept_encoding(header: str) -> dict[str, float]:
+    """Get q-values of encodings from Accept-Encoding header"""
+    encodings = {}
+    for item in header.split(','):
+        encoding, _, params = item.partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding: continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[encoding] = quality
+    return encodings
+
+
+def negotiate_encoding(request, available) -> Optional[str]:
+    """
+    Get the accepted encoding with the highest q-value out of `available`
+    (in the order of server preference) or None
+    """
+    accepted = _parse_accept_encoding(
+        request.headers.get(hdrs.ACCEPT_ENCODING, '')
+    )
+    wildcard_quality = accepted.get('*', 0.0)
+    best_encoding, best_quality = None, 0.0
+    for encoding in available:
+        quality = accepted.get(encoding, wildcard_quality)
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+def _is_compressible(response: web.StreamResponse) -> bool:
+    return (
+        hdrs.CONTENT_ENCODING not in response.headers and
+        response.content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+    )
+
+
+def _add_vary(response: web.StreamResponse) -> None:
+    vary = response.headers.get(hdrs.VARY)
+    if vary is None:
+        response.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+    elif hdrs.ACCEPT_ENCODING.lower() not in vary.lower():
+        response.headers[hdrs.VARY] = f'{vary}, {hdrs.ACCEPT_ENCODING}'
+
+
+def enable_stream_compression(request,
+        response: web.StreamResponse) -> None:
+    """
+    Enable gzip of the streamed response if the client accepts it. Call
+    it before the response is prepared, streamed chunks are compressed by
+    aiohttp on write
+    """
+    conf = get_compression_conf(request.app['config'])
+    if not conf['enabled'] or not _is_compressible(response): return
+    _add_vary(response)
+    if negotiate_encoding(request, ('gzip',)) == 'gzip':
+        response.enable_compression(ContentCoding.gzip)
+
+
+def create_compression_middleware(conf: dict):
+    """
+    Create middleware compressing bodies of complete responses with the
+    best encoding accepted by the client (zstd, br if their packages are
+    installed, gzip)
+    """
+    min_size = conf['min_size']
+    executor_min_size = conf['executor_min_size']
+
+    @web.middleware
+    async def compression_middleware(request, handler):
+        response = await handler(request)
+        if not isinstance(response, web.Response) or response.prepared:
+            return response
+        body = response.body
+        if not isinstance(body, bytes) or len(body) < min_size:
+            return response
+        if not _is_compressible(response): return response
+
+        _add_vary(response)
+        encoding = negotiate_encoding(request, COMPRESSORS)
+        if encoding is None: return response
+        compress = COMPRESSORS[encoding]
+        if len(body) >= executor_min_size:
+            body = await asyncio.get_running_loop().run_in_executor(
+                None, compress, body
+            )
+        else:
+            body = compress(body)
+        response.body = body
+        response.headers.pop(hdrs.CONTENT_LENGTH, None)
+        response.headers[hdrs.CONTENT_ENCODING] = encoding
+        # The representation differs from the uncompressed one, so its
+        # ETag is weak. Weak tags match on If-None-Match anyway
+        etag = response.headers.get(hdrs.ETAG)
+        if etag and not etag.startswith('W/'):
+            response.headers[hdrs.ETAG] = f'W/{etag}'
+        return response
+
+    return compression_middleware
+
+
+def get_compression_conf(config: dict) -> dict:
+    return dict(COMPRESSION_DEFAULTS, **config.get('compression', {}))
@@ -1,12 +1,171 @@
+import asyncio
+import time
+from typing import Optional
+
 import aiopg.sa
 
+from .cache import LRUCache
+from .metrics import REGISTRY, Gauge, Histogram
+from .tracing import QueryTracer, TracedConnection, create_query_tracer
+
+
+POOL_DEFAULTS = {'minsize': 1, 'maxsize': 10, 'timeout': 60.0}
+
+# Reads of users data written less than `ttl` seconds ago go to the primary
+READ_YOUR_WRITES_DEFAULTS = {'ttl': 5.0, 'maxsize': 100000}
+
+ACQUIRE_WAIT = REGISTRY.register(Histogram(
+    'ratingsite_db_acquire_wait_seconds',
+    'Time spent waiting for a connection from the pool', ('pool',)
+))
+
+
+class _TimedAcquireContext:
+    """Async context manager acquiring connection and recording the wait"""
+
+    def __init__(self, engine: 'InstrumentedEngine') -> None:
+        self._engine = engine
+        self._acquire_context = None
+
+    async def __aenter__(self):
+        self._engine.waiting += 1
+        start = time.perf_counter()
+        try:
+            self._acquire_context = self._engine.engine.acquire()
+            conn = await self._acquire_context.__aenter__()
+        finally:
+            self._engine.waiting -= 1
+            ACQUIRE_WAIT.observe(
+                time.perf_counter() - start, self._engine.name
+            )
+        if self._engine.query_tracer is not None:
+            return TracedConnection(conn, self._engine.query_tracer)
+        return conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await self._acquire_context.__aexit__(exc_type, exc, tb)
+
+
+class InstrumentedEngine:
+    """
+    aiopg.sa engine wrapper recording time spent waiting for connections
+    and exposing pool state in metrics. If there is `query_tracer`
+    acquired connections pass executed statements to it
+    """
+
+    def __init__(self, engine, name: str = 'primary',
+            query_tracer: Optional[QueryTracer] = None) -> None:
+        self.engine = engine
+        self.name = name
+        self.query_tracer = query_tracer
+        self.waiting = 0
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def acquire(self) -> _TimedAcquireContext:
+        return _TimedAcquireContext(self)
+
+    def register_metrics(self) -> None:
+        """Register pool state gauges"""
+        for metric, documentation, func in (
+            ('size', 'Number of open connections', lambda: self.engine.size),
+            ('free', 'Number of free connections',
+                lambda: self.engine.freesize),
+            ('used', 'Number of acquired connections',
+                lambda: self.engine.size - self.engine.freesize),
+            ('maxsize', 'Max number of connections',
+                lambda: self.engine.maxsize),
+            ('waiting', 'Number of coroutines waiting for a connection',
+                lambda: self.waiting),
+        ):
+            REGISTRY.register(Gauge(
+                f'ratingsite_db_{self.name}_pool_{metric}',
+                documentation, func
+            ))
+
+
+async def fetch_dicts(result) -> list[dict]:
+    """
+    Fetch all rows of the result as dicts reading raw DB-API rows and
+    skipping RowProxy and result processors. Use it only for selects of
+    columns without result processors (plain integers, strings, booleans)
+    """
+    keys = result.keys()
+    rows = await result.cursor.fetchall()
+    result.close()
+    return [dict(zip(keys, row)) for row in rows]
+
+
+async def warm_up(engine) -> None:
+    """Open minsize connections and check them with a query"""
+
+    async def check_connection():
+        async with engine.acquire() as conn:
+            await conn.execute('SELECT 1')
+
+    await asyncio.gather(*(
+        check_connection() for _ in range(engine.minsize)
+    ))
+
+
+async def create_engine(conf: dict, name: str,
+        query_tracer: Optional[QueryTracer] = None) -> InstrumentedEngine:
+    """Create warmed up instrumented engine using postgres config"""
+    engine = await aiopg.sa.create_engine(**dict(POOL_DEFAULTS, **conf))
+    await warm_up(engine)
+    instrumented_engine = InstrumentedEngine(engine, name, query_tracer)
+    instrumented_engine.register_metrics()
+    return instrumented_engine
+
+
+def remember_writes(app, *nicknames: str) -> None:
+    """
+    Remember the users whose data is written, so their data is read from
+    the primary until the replica has the writes
+    """
+    recent_writes = app['recent_writes']
+    if recent_writes is None: return
+    for nickname in nicknames:
+        recent_writes.set(nickname, True)
+
+
+def get_read_db(request, *nicknames: str) -> InstrumentedEngine:
+    """
+    Get engine for read-only queries of data of the users with
+    `nicknames`: the replica, or the primary if the current user or one of
+    the users was written recently (read-your-writes). Recent writes are
+    remembered per worker process, the window should cover the replica lag
+    """
+    app = request.app
+    recent_writes = app['recent_writes']
+    if recent_writes is None: return app['db_read']
+    if request.user: nicknames += (request.user['nickname'],)
+    if any(recent_writes.get(nickname) for nickname in nicknames):
+        return app['db']
+    return app['db_read']
+
 
 async def pg_context(app):
     conf = app['config']['postgres']
-    engine = await aiopg.sa.create_engine(**conf)
-    app['db'] = engine
+    query_tracer = create_query_tracer(app['config'].get('tracing', {}))
+    app['db'] = await create_engine(conf, 'primary', query_tracer)
+    app['db_read'] = app['db']
+    app['recent_writes'] = None
+    replica_conf = app['config'].get('postgres_replica')
+    if replica_conf:
+        # Missing replica settings (credentials, pool size) are the primary
+        # ones
+        app['db_read'] = await create_engine(
+            dict(conf, **replica_conf), 'replica', query_tracer
+        )
+        app['recent_writes'] = LRUCache(**dict(
+            READ_YOUR_WRITES_DEFAULTS,
+            **app['config'].get('read_your_writes', {})
+        ))
 
     yield
 
-    app['db'].close()
-    await app['db'].wait_closed()
+    for engine in {app['db'], app['db_read']}:
+        engine.close()
+        await engine.wait_closed()
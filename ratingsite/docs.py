@@ -0,0 +1,89 @@
+"""
+Swagger docs served without generating them on startup. Run as a module
+to pre-generate swagger.json used instead of generation on the first hit:
+
+    python -m ratingsite.docs config/swagger.json
+"""
+import json
+import sys
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+
+from .settings import BASE_DIR
+
+
+DOCS_URL = '/api/v1/doc'
+
+
+def _get_swagger_ui_path() -> Path:
+    """Get aiohttp_swagger UI static files path without importing it"""
+    spec = find_spec('aiohttp_swagger')
+    return Path(spec.submodule_search_locations[0]) / 'swagger_ui'
+
+
+class SwaggerDocs:
+    """
+    Swagger UI and definition of the app routes. The definition is read
+    from `swagger_file` if it exists or generated from handlers docstrings
+    on the first request, so aiohttp_swagger (with jinja2) is imported only
+    then
+    """
+
+    def __init__(self, url: str = DOCS_URL,
+            swagger_file: Optional[Path] = None) -> None:
+        self.url = url.rstrip('/')
+        self.definition_url = f'{self.url}/swagger.json'
+        self.static_url = f'{self.url}/swagger_static'
+        self._swagger_file = swagger_file
+        self._index = None
+        self._definition = None
+
+    def setup(self, app: web.Application) -> None:
+        app.router.add_get(self.url, self.index)
+        app.router.add_get(f'{self.url}/', self.index)
+        app.router.add_get(self.definition_url, self.definition)
+        app.router.add_static(self.static_url, _get_swagger_ui_path())
+
+    @staticmethod
+    def generate(app: web.Application) -> str:
+        """Generate swagger definition JSON from handlers docstrings"""
+        from aiohttp_swagger.helpers import generate_doc_from_each_end_point
+        return generate_doc_from_each_end_point(app)
+
+    def _load_definition(self, app: web.Application) -> str:
+        if self._swagger_file and self._swagger_file.exists():
+            return self._swagger_file.read_text()
+        return self.generate(app)
+
+    async def index(self, request) -> web.Response:
+        if self._index is None:
+            index_path = _get_swagger_ui_path() / 'index.html'
+            self._index = index_path.read_text().replace(
+                '##SWAGGER_CONFIG##', self.definition_url
+            ).replace(
+                '##STATIC_PATH##', self.static_url
+            ).replace('##SWAGGER_VALIDATOR_URL##', '')
+        return web.Response(text=self._index, content_type='text/html')
+
+    async def definition(self, request) -> web.Response:
+        if self._definition is None:
+            self._definition = self._load_definition(request.app)
+        return web.json_response(text=self._definition)
+
+
+def setup_docs(app: web.Application, conf: dict) -> None:
+    swagger_file = conf.get('swagger_file')
+    if swagger_file: swagger_file = BASE_DIR / swagger_file
+    SwaggerDocs(DOCS_URL, swagger_file).setup(app)
+
+
+if __name__ == '__main__':
+    from main import create_app
+    from ratingsite.settings import config
+
+    swagger = SwaggerDocs.generate(create_app(config))
+    # Validate and pretty print the generated definition
+    Path(sys.argv[1]).write_text(json.dumps(json.loads(swagger), indent=2))
@@ -0,0 +1,27 @@
+import json
+from typing import Any, Optional
+
+from aiohttp.web import Response
+
+from .tracing import trace_span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data: Any) -> bytes:
+    """Encode data to JSON bytes with orjson if it's installed"""
+    with trace_span('serialization'):
+        if orjson is not None: return orjson.dumps(data)
+        return json.dumps(data).encode()
+
+
+def json_response(data: Any, *, status: int = 200,
+        headers: Optional[dict] = None) -> Response:
+    """Same as aiohttp.web.json_response, but encoding data with `dumps`"""
+    return Response(
+        body=dumps(data), status=status, headers=headers,
+        content_type='application/json'
+    )
@@ -0,0 +1,156 @@
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0
+)
+
+
+def _escape_label_value(value) -> str:
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple,
+        extra: Optional[dict] = None) -> str:
+    """Format labels in Prometheus text format: {name="value",...}"""
+    labels = list(zip(labelnames, labelvalues))
+    if extra: labels.extend(extra.items())
+    if not labels: return ''
+    formatted = ','.join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in labels
+    )
+    return '{' + formatted + '}'
+
+
+class Gauge:
+    """Gauge which value is got from the function on every collect"""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+            func: Callable[[], float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._func = func
+
+    def collect(self) -> list[str]:
+        return [f'{self.name} {self._func()}']
+
+
+class Counter:
+    """Monotonically increasing counter with labels"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str,
+            labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self) -> list[str]:
+        return [
+            f'{self.name}{_format_labels(self._labelnames, labelvalues)} '
+            f'{value}'
+            for labelvalues, value in self._values.items()
+        ]
+
+
+class Histogram:
+    """Histogram of observed values with labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+            labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = labelnames
+        self._buckets = buckets
+        self._values = {}
+
+    def observe(self, value: float, *labelvalues) -> None:
+        """Add observed value for the labels"""
+        values = self._values.get(labelvalues)
+        if values is None:
+            values = self._values[labelvalues] = {
+                'buckets': [0] * len(self._buckets), 'sum': 0.0, 'count': 0
+            }
+        bucket_index = bisect_left(self._buckets, value)
+        if bucket_index < len(self._buckets):
+            values['buckets'][bucket_index] += 1
+        values['sum'] += value
+        values['count'] += 1
+
+    def collect(self) -> list[str]:
+        lines = []
+        for labelvalues, values in self._values.items():
+            cumulative = 0
+            for upper_bound, count in zip(self._buckets, values['buckets']):
+                cumulative += count
+                labels = _format_labels(
+                    self._labelnames, labelvalues, {'le': upper_bound}
+                )
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(
+                self._labelnames, labelvalues, {'le': '+Inf'}
+            )
+            lines.append(f'{self.name}_bucket{labels} {values["count"]}')
+            labels = _format_labels(self._labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {values["sum"]}')
+            lines.append(f'{self.name}_count{labels} {values["count"]}')
+        return lines
+
+
+class Registry:
+    """Metrics registry rendering metrics in Prometheus text format"""
+
+    def __init__(self) -> None:
+        self._metrics = {}
+
+    def register(self, metric):
+        """Register the metric replacing the metric with the same name"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SERVICE_DURATION = REGISTRY.register(Histogram(
+    'ratingsite_service_duration_seconds',
+    'Duration of service methods (including their queries)', ('method',)
+))
+
+
+def timed(func):
+    """Observe duration of the async function in SERVICE_DURATION"""
+    method = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            SERVICE_DURATION.observe(time.perf_counter() - start, method)
+
+    return wrapper
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+import aiopg
+import psycopg2
+
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5.0
+
+CONNECTION_PARAMS = ('database', 'user', 'password', 'host', 'port')
+
+
+class NotificationListener:
+    """
+    Keeps in-process data in sync with writes of other worker processes:
+    listens to the channel notifications on a dedicated connection. `load`
+    loads all data with a pooled connection after LISTEN, so no
+    notification is missed, and `handle` gets payloads of every batch of
+    received notifications. On connection errors it reconnects and loads
+    all data again
+    """
+
+    def __init__(self, engine, postgres_conf: dict, channel: str,
+            load: Callable[..., Awaitable[None]],
+            handle: Callable[[list[str]], Awaitable[None]]) -> None:
+        self._engine = engine
+        self._connection_kwargs = {
+            name: value for name, value in postgres_conf.items()
+            if name in CONNECTION_PARAMS
+        }
+        self._channel = channel
+        self._load = load
+        self._handle = handle
+        self._listen_conn = None
+        self._task = None
+
+    async def _connect(self) -> None:
+        self._listen_conn = await aiopg.connect(**self._connection_kwargs)
+        async with self._listen_conn.cursor() as cursor:
+            await cursor.execute(f'LISTEN {self._channel}')
+        async with self._engine.acquire() as conn:
+            await self._load(conn)
+
+    async def _process_notifications(self) -> None:
+        notifies = self._listen_conn.notifies
+        while True:
+            payloads = [(await notifies.get()).payload]
+            while not notifies.empty():
+                payloads.append(notifies.get_nowait().payload)
+            await self._handle(payloads)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._listen_conn is None: await self._connect()
+                await self._process_notifications()
+            except (psycopg2.Error, OSError):
+                logger.exception(
+                    'Listening to %s failed, reconnecting', self._channel
+                )
+                await self._close_connection()
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def start(self) -> None:
+        """Start listening and load all data, then process notifications"""
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def _close_connection(self) -> None:
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+            self._listen_conn = None
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close_connection()
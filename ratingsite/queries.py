@@ -0,0 +1,106 @@
+import re
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from psycopg2.errors import InvalidSqlStatementName
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+
+PARAM_REGEX = re.compile(r'%\((\w+)\)s')
+
+
+class CompiledQuery:
+    """
+    Statement compiled to SQL once. Parameters are passed by bindparam
+    names, values bound in the statement (constants) are used by default
+    """
+
+    def __init__(self, name: str, statement, dialect) -> None:
+        compiled = statement.compile(dialect=dialect)
+        self.name = name
+        self.statement = statement
+        self.sql = str(compiled)
+        self._defaults = compiled.params
+        self._bind_processors = compiled._bind_processors
+        # Server-side prepared statement uses positional $n parameters
+        self.param_names = list(dict.fromkeys(PARAM_REGEX.findall(self.sql)))
+        positions = {
+            param_name: position
+            for position, param_name in enumerate(self.param_names, 1)
+        }
+        self.prepare_sql = f'PREPARE {name} AS ' + PARAM_REGEX.sub(
+            lambda match: f'${positions[match.group(1)]}', self.sql
+        )
+        self.execute_sql = f'EXECUTE {name}'
+        if self.param_names:
+            self.execute_sql += '(' + ', '.join(
+                f'%({param_name})s' for param_name in self.param_names
+            ) + ')'
+
+    def get_params(self, **params) -> dict:
+        """
+        Get statement parameters: defaults updated with `params` and
+        processed by the columns types bind processors
+        """
+        params = dict(self._defaults, **params)
+        for key, value in params.items():
+            processor = self._bind_processors.get(key)
+            if processor is not None and value is not None:
+                params[key] = processor(value)
+        return params
+
+
+class QueryRegistry:
+    """
+    Registry of statements compiled once on registration and executed as
+    server-side prepared statements. Every pooled connection prepares the
+    statement on its first execution and then only executes it, so
+    Postgres can reuse the plan. Prepared statements are tracked per
+    connection and forgotten with closed connections
+    """
+
+    def __init__(self) -> None:
+        self._dialect = PGDialect_psycopg2()
+        self._queries = {}
+        self._queries_by_execute_sql = {}
+        self._prepared = WeakKeyDictionary()
+
+    def register(self, name: str, statement) -> CompiledQuery:
+        """Compile the statement and register it with unique name"""
+        if name in self._queries:
+            raise ValueError(f'Query {name} is already registered')
+        query = CompiledQuery(name, statement, self._dialect)
+        self._queries[name] = query
+        self._queries_by_execute_sql[query.execute_sql] = query
+        return query
+
+    def get(self, name: str) -> CompiledQuery:
+        return self._queries[name]
+
+    def get_executed(self, sql) -> Optional[CompiledQuery]:
+        """Get the query executed by EXECUTE `sql` or None"""
+        if not isinstance(sql, str): return None
+        return self._queries_by_execute_sql.get(sql)
+
+    async def _prepare(self, conn, query: CompiledQuery) -> None:
+        await conn.execute(query.prepare_sql)
+        self._prepared.setdefault(conn.connection, set()).add(query.name)
+
+    async def execute(self, conn, query: CompiledQuery, **params):
+        """
+        Execute the query prepared on the connection (aiopg.sa connection)
+        with parameters, return aiopg.sa result
+        """
+        prepared = self._prepared.get(conn.connection, ())
+        if query.name not in prepared: await self._prepare(conn, query)
+        params = query.get_params(**params)
+        try:
+            return await conn.execute(query.execute_sql, params)
+        except InvalidSqlStatementName:
+            # Statements were deallocated (DISCARD ALL), prepare again
+            self._prepared.pop(conn.connection, None)
+            await self._prepare(conn, query)
+            return await conn.execute(query.execute_sql, params)
+
+
+QUERIES = QueryRegistry()
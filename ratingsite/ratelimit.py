@@ -0,0 +1,232 @@
+import asyncio
+import math
+import time
+from typing import Optional
+
+from aiohttp import web
+
+from .cache import LRUCache
+from .metrics import REGISTRY, Counter
+
+
+RATE_LIMIT_DEFAULTS = {
+    'backend': 'memory',
+    'maxsize': 100000,
+    # Token buckets: `rate` tokens per second, at most `burst` tokens
+    'ip': {'rate': 1.0, 'burst': 20},
+    'email': {'rate': 0.1, 'burst': 5},
+    # Admission control of rate limited handlers
+    'max_concurrency': 16,
+    'max_queue': 64,
+}
+
+REJECTED_REQUESTS = REGISTRY.register(Counter(
+    'ratingsite_rejected_requests_total',
+    'Requests rejected by rate limits and load shedding', ('reason',)
+))
+
+# Token bucket update executed atomically by Redis. Returns seconds to
+# wait for a token, 0 if the token is taken
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+def rate_limited(handler):
+    """
+    Mark handler (function or view class) as rate limited: requests are
+    limited per client IP and per `email` of JSON body and pass admission
+    control
+    """
+    handler.rate_limited = True
+    return handler
+
+
+class MemoryRateLimitBackend:
+    """
+    In-process token buckets. Every worker process has its own buckets, so
+    the effective limit is multiplied by the number of workers
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self._buckets = LRUCache(maxsize)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token, return seconds to wait for it or 0 if it's taken"""
+        now = time.time()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        # A bucket is full again after burst / rate seconds, so it can expire
+        self._buckets.set(key, (tokens, now), now + burst / rate)
+        return retry_after
+
+    async def close(self) -> None:
+        self._buckets.clear()
+
+
+class RedisRateLimitBackend:
+    """
+    Token buckets in Redis shared by all workers. `client` is
+    redis.asyncio.Redis or any object with the same async eval and close
+    methods
+    """
+
+    def __init__(self, client) -> None:
+        self._client = client
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        retry_after = await self._client.eval(
+            TOKEN_BUCKET_SCRIPT, 1, f'rate_limit:{key}', rate, burst,
+            time.time()
+        )
+        return float(retry_after)
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+class RateLimiter:
+    """Token bucket limits of requests per client IP and per email"""
+
+    def __init__(self, backend, ip_limit: dict, email_limit: dict) -> None:
+        self._backend = backend
+        self._ip_limit = ip_limit
+        self._email_limit = email_limit
+
+    @staticmethod
+    async def _get_email(request) -> Optional[str]:
+        """Get email from JSON body, the body is cached for the handler"""
+        try:
+            data = await request.json()
+        except ValueError:
+            return None
+        email = data.get('email') if isinstance(data, dict) else None
+        return email.lower() if isinstance(email, str) else None
+
+    async def check(self, request) -> tuple[float, Optional[str]]:
+        """
+        Take tokens of the request, return seconds to wait and the
+        exceeded limit name or (0, None) if the request is allowed
+        """
+        retry_after = await self._backend.take(
+            f'ip:{request.remote}', **self._ip_limit
+        )
+        if retry_after: return retry_after, 'ip'
+        email = await self._get_email(request)
+        if email is None: return 0, None
+        retry_after = await self._backend.take(
+            f'email:{email}', **self._email_limit
+        )
+        if retry_after: return retry_after, 'email'
+        return 0, None
+
+
+class AdmissionController:
+    """
+    Limits the number of concurrently handled requests and sheds load: if
+    `max_queue` requests are already waiting new ones are rejected at once
+    instead of queueing and holding connections and memory
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int) -> None:
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_queue = max_queue
+        self._waiting = 0
+
+    @property
+    def is_overloaded(self) -> bool:
+        return self._semaphore.locked() and self._waiting >= self._max_queue
+
+    async def __aenter__(self) -> None:
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._semaphore.release()
+
+
+def _rejected_response(status: int, error: str,
+        retry_after: float) -> web.Response:
+    return web.json_response({'error': error}, status=status, headers={
+        'Retry-After': str(max(1, math.ceil(retry_after)))
+    })
+
+
+@web.middleware
+async def rate_limit_middleware(request, handler):
+    """Apply rate limits and admission control to rate limited handlers"""
+    if not getattr(request.match_info.handler, 'rate_limited', False):
+        return await handler(request)
+
+    retry_after, limit = await request.app['rate_limiter'].check(request)
+    if retry_after:
+        REJECTED_REQUESTS.inc(f'rate_limit_{limit}')
+        return _rejected_response(429, 'Too many requests', retry_after)
+
+    admission = request.app['admission_controller']
+    if admission.is_overloaded:
+        REJECTED_REQUESTS.inc('overload')
+        return _rejected_response(503, 'Server is overloaded', 1)
+
+    async with admission:
+        return await handler(request)
+
+
+def create_rate_limit_backend(conf: dict):
+    """Create memory (default) or Redis rate limit backend"""
+    if conf['backend'] == 'redis':
+        from redis.asyncio import Redis  # optional dependency
+        return RedisRateLimitBackend(Redis.from_url(conf['redis_url']))
+    return MemoryRateLimitBackend(conf['maxsize'])
+
+
+def get_rate_limit_conf(config: dict) -> dict:
+    """
+    Get rate limit settings merged with defaults, limits are merged with
+    default limits too
+    """
+    conf = dict(RATE_LIMIT_DEFAULTS, **config.get('rate_limit', {}))
+    for name in ('ip', 'email'):
+        limit = dict(RATE_LIMIT_DEFAULTS[name], **conf[name])
+        if limit.keys() != RATE_LIMIT_DEFAULTS[name].keys():
+            raise ValueError(
+                f'rate_limit.{name} takes only rate and burst settings'
+            )
+        conf[name] = limit
+    return conf
+
+
+async def rate_limit_context(app):
+    conf = get_rate_limit_conf(app['config'])
+    backend = create_rate_limit_backend(conf)
+    app['rate_limiter'] = RateLimiter(backend, conf['ip'], conf['email'])
+    app['admission_controller'] = AdmissionController(
+        conf['max_concurrency'], conf['max_queue']
+    )
+
+    yield
+
+    await backend.close()
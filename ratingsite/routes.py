@@ -1,8 +1,11 @@
-from aiohttp_swagger import setup_swagger
-
+from ratings.routes import routes as ratings_routes
 from users.routes import setup_users_routes
+from . import views
+from .docs import setup_docs
 
 
 def setup_routes(app):
     setup_users_routes(app)
-    setup_swagger(app, swagger_url='/api/v1/doc')
+    app.add_routes(ratings_routes)
+    app.router.add_get('/metrics', views.metrics)
+    setup_docs(app, app['config'].get('docs', {}))
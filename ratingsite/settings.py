@@ -2,6 +2,9 @@ import pathlib
 
 import yaml
 
+# libyaml loader is much faster if PyYAML is built with it
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 BASE_DIR = pathlib.Path(__file__).parent.parent
 
@@ -10,7 +13,7 @@ config_path = BASE_DIR / 'config' / 'ratingsite.yaml'
 
 def get_config(path):
     with open(path) as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=SafeLoader)
 
     return config
 
@@ -0,0 +1,254 @@
+import contextlib
+import logging
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from .queries import QUERIES
+
+
+logger = logging.getLogger(__name__)
+
+# Max spans recorded per request, streaming responses can serialize and
+# query thousands of chunks
+MAX_SPANS = 1000
+
+TRACING_DEFAULTS = {
+    'enabled': False,
+    # Seconds, None disables slow requests and queries logging
+    'slow_request_threshold': None,
+    'slow_query_threshold': None,
+    'explain_slow_queries': False,
+}
+
+current_trace: ContextVar[Optional['Trace']] = ContextVar(
+    'current_trace', default=None
+)
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Span:
+    """Named timed part of the request, SQL spans keep the statement"""
+
+    __slots__ = ('name', 'start', 'duration', 'statement', 'dialect')
+
+    def __init__(self, name: str, start: float, duration: float,
+            statement=None, dialect=None) -> None:
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.statement = statement
+        self.dialect = dialect
+
+    def to_dict(self, trace_start: float) -> dict:
+        """
+        Get span as dict with milliseconds. SQL statements are compiled
+        only here, so recording them is cheap
+        """
+        span = {
+            'name': self.name,
+            'start_ms': round((self.start - trace_start) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+        }
+        if self.statement is not None:
+            span['statement'] = compile_statement(
+                self.statement, self.dialect
+            )
+        return span
+
+
+class Trace:
+    """Spans of one request"""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add_span(self, name: str, start: float, duration: float,
+            statement=None, dialect=None) -> None:
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(Span(name, start, duration, statement, dialect))
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter() - start)
+
+    def to_dict(self) -> dict:
+        """Get total duration and spans with durations by span names"""
+        durations = {}
+        for span in self.spans:
+            durations[span.name] = durations.get(span.name, 0) + span.duration
+        return {
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 3),
+            'durations_ms': {
+                name: round(duration * 1000, 3)
+                for name, duration in durations.items()
+            },
+            'spans': [span.to_dict(self.start) for span in self.spans],
+        }
+
+
+def trace_span(name: str):
+    """
+    Context manager recording the span in the current request trace, it
+    does nothing if the request isn't traced
+    """
+    trace = current_trace.get()
+    if trace is None: return _NO_SPAN
+    return trace.span(name)
+
+
+def compile_statement(statement, dialect) -> str:
+    """Get SQL text of SQLAlchemy statement or string statement"""
+    if isinstance(statement, str): return statement
+    return str(statement.compile(dialect=dialect))
+
+
+class QueryTracer:
+    """
+    Records SQL statements durations in the current request trace and logs
+    statements slower than `slow_query_threshold` seconds, with EXPLAIN
+    output of slow selects if `explain` is True. Prepared statements of
+    QUERIES are recorded and logged with their compiled SQL and explained
+    with EXPLAIN EXECUTE, so the plan is the one of the prepared statement
+    """
+
+    def __init__(self, slow_query_threshold: Optional[float] = None,
+            explain: bool = False) -> None:
+        self._slow_query_threshold = slow_query_threshold
+        self._explain = explain
+
+    async def _explain_statement(self, conn, statement,
+            params: Optional[dict]) -> str:
+        if isinstance(statement, str) and params:
+            cursor = await conn.execute('EXPLAIN ' + statement, params)
+        elif isinstance(statement, str):
+            cursor = await conn.execute('EXPLAIN ' + statement)
+        else:
+            compiled = statement.compile(dialect=conn._dialect)
+            cursor = await conn.execute(
+                'EXPLAIN ' + str(compiled), compiled.params
+            )
+        return '\n'.join(row[0] for row in await cursor.fetchall())
+
+    async def record(self, conn, statement, params: Optional[dict],
+            start: float, duration: float) -> None:
+        prepared_query = QUERIES.get_executed(statement)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span('sql', start, duration, (
+                statement if prepared_query is None
+                else prepared_query.statement
+            ), conn._dialect)
+        if self._slow_query_threshold is None: return
+        if duration < self._slow_query_threshold: return
+
+        if prepared_query is None:
+            sql = compile_statement(statement, conn._dialect)
+        else:
+            sql = prepared_query.sql
+        if params: sql += f' {params}'
+        plan = ''
+        if self._explain and sql.lstrip().upper().startswith('SELECT'):
+            plan = '\n' + await self._explain_statement(
+                conn, statement, params
+            )
+        logger.warning('Slow query (%.3fs): %s%s', duration, sql, plan)
+
+
+class TracedConnection:
+    """aiopg.sa connection proxy passing executed statements to the tracer"""
+
+    def __init__(self, conn, tracer: QueryTracer) -> None:
+        self._conn = conn
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def execute(self, query, *multiparams, **params):
+        start = time.perf_counter()
+        result = await self._conn.execute(query, *multiparams, **params)
+        await self._tracer.record(
+            self._conn, query, multiparams[0] if multiparams else params,
+            start, time.perf_counter() - start
+        )
+        return result
+
+    async def scalar(self, query, *multiparams, **params):
+        result = await self.execute(query, *multiparams, **params)
+        return await result.scalar()
+
+
+def create_query_tracer(conf: dict) -> Optional[QueryTracer]:
+    """Create query tracer if tracing or slow queries logging is enabled"""
+    conf = dict(TRACING_DEFAULTS, **conf)
+    if not conf['enabled'] and conf['slow_query_threshold'] is None:
+        return None
+    return QueryTracer(
+        conf['slow_query_threshold'], conf['explain_slow_queries']
+    )
+
+
+def _is_profile_requested(request) -> bool:
+    return request.query.get('profile') == '1'
+
+
+def _is_streamed(response: web.StreamResponse) -> bool:
+    # prepared is False again after write_eof of the streaming handler
+    return response.prepared or not isinstance(response, web.Response)
+
+
+def create_tracing_middleware(
+        can_profile: Callable[[web.Request], Awaitable[bool]]):
+    """
+    Create middleware tracing the request. The response is written here
+    to record the write span. Requests slower than the slow request
+    threshold are logged with durations of their spans. Users allowed by
+    `can_profile` (superusers) can get the spans instead of the response
+    with `?profile=1`, except streamed responses
+    """
+
+    @web.middleware
+    async def tracing_middleware(request, handler):
+        trace = Trace()
+        token = current_trace.set(trace)
+        try:
+            response = await handler(request)
+        finally:
+            current_trace.reset(token)
+
+        # Streamed responses are already written, they can't be replaced
+        if (not _is_streamed(response) and _is_profile_requested(request)
+                and await can_profile(request)):
+            return web.json_response(
+                dict(trace.to_dict(), status=response.status)
+            )
+
+        # Streaming responses are prepared and written by handlers
+        if not response.prepared:
+            with trace.span('response_write'):
+                await response.prepare(request)
+                await response.write_eof()
+
+        threshold = request.app['config'].get('tracing', {}).get(
+            'slow_request_threshold'
+        )
+        if threshold is not None:
+            total = time.perf_counter() - trace.start
+            if total >= threshold:
+                logger.warning(
+                    'Slow request (%.3fs) %s %s: %s', total,
+                    request.method, request.path_qs,
+                    trace.to_dict()['durations_ms']
+                )
+        return response
+
+    return tracing_middleware
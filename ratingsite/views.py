@@ -0,0 +1,21 @@
+from aiohttp.web import Response
+
+from users.middlewares import skip_authentication
+from .metrics import REGISTRY
+
+
+@skip_authentication
+async def metrics(request):
+    """
+    ---
+    description: Return metrics in Prometheus text format
+    tags:
+    - metrics
+    responses:
+        "200":
+            description: successful operation
+    """
+    return Response(
+        text=REGISTRY.render(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
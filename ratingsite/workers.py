@@ -0,0 +1,149 @@
+import copy
+import multiprocessing
+import os
+import signal
+import time
+from typing import Callable
+
+from aiohttp import web
+
+
+WATCH_INTERVAL = 1.0
+
+DEFAULT_STOP_TIMEOUT = 30.0
+
+
+def get_workers_count(config: dict) -> int:
+    """Get the configured number of worker processes, 0 means CPU cores"""
+    return config.get('server', {}).get('workers', 1) or os.cpu_count()
+
+
+def get_worker_config(config: dict, workers_count: int) -> dict:
+    """
+    Copy config with the postgres pool maxsize of one worker derived from
+    the server postgres connection budget shared by all workers
+    """
+    config = copy.deepcopy(config)
+    budget = config.get('server', {}).get('postgres_connection_budget')
+    if budget:
+        postgres_conf = config['postgres']
+        postgres_conf['maxsize'] = max(1, budget // workers_count)
+        postgres_conf['minsize'] = min(
+            postgres_conf.get('minsize', 1), postgres_conf['maxsize']
+        )
+    return config
+
+
+def _run_worker(app_factory: Callable, config: dict, host: str,
+        port: int) -> None:
+    """Run the application in the worker process"""
+    # Reset handlers inherited from the manager, aiohttp sets its own ones
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    app = app_factory(config)
+    web.run_app(
+        app, host=host, port=port, reuse_port=True, print=None,
+        shutdown_timeout=config.get('server', {}).get(
+            'stop_timeout', DEFAULT_STOP_TIMEOUT
+        )
+    )
+
+
+class WorkersManager:
+    """
+    Pre-fork manager running the application in N worker processes. All
+    workers listen the same port with SO_REUSEPORT, so the kernel balances
+    connections between them. Dead workers are respawned, SIGHUP gracefully
+    restarts workers (new workers are started before the old ones are
+    stopped, so the connection budget is exceeded twice during restart),
+    SIGTERM and SIGINT gracefully stop them
+    """
+
+    def __init__(self, app_factory: Callable, config: dict) -> None:
+        server_conf = config.get('server', {})
+        self._app_factory = app_factory
+        self._workers_count = get_workers_count(config)
+        self._worker_config = get_worker_config(config, self._workers_count)
+        self._host = server_conf.get('host', '0.0.0.0')
+        self._port = server_conf.get('port', 8080)
+        self._stop_timeout = server_conf.get(
+            'stop_timeout', DEFAULT_STOP_TIMEOUT
+        )
+        self._context = multiprocessing.get_context('fork')
+        self._workers = []
+        self._is_stopping = False
+        self._is_restarting = False
+
+    def _spawn_worker(self):
+        """Start a new worker process"""
+        worker = self._context.Process(target=_run_worker, args=(
+            self._app_factory, self._worker_config, self._host, self._port
+        ))
+        worker.start()
+        return worker
+
+    def _stop_workers(self, workers: list) -> None:
+        """Gracefully stop workers, kill them after stop timeout"""
+        for worker in workers:
+            if worker.is_alive(): worker.terminate()
+        deadline = time.monotonic() + self._stop_timeout
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive(): worker.kill()
+            worker.join()
+
+    def _respawn_dead_workers(self) -> None:
+        for index, worker in enumerate(self._workers):
+            if not worker.is_alive():
+                worker.join()
+                self._workers[index] = self._spawn_worker()
+
+    def _restart_workers(self) -> None:
+        self._is_restarting = False
+        old_workers = self._workers
+        self._workers = [
+            self._spawn_worker() for _ in range(self._workers_count)
+        ]
+        self._stop_workers(old_workers)
+
+    def _handle_stop(self, signum, frame) -> None:
+        self._is_stopping = True
+
+    def _handle_restart(self, signum, frame) -> None:
+        self._is_restarting = True
+
+    def run(self) -> None:
+        """Start workers and watch them until the manager is stopped"""
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+        self._workers = [
+            self._spawn_worker() for _ in range(self._workers_count)
+        ]
+        print(
+            f'======== Running {self._workers_count} workers on '
+            f'http://{self._host}:{self._port} ========'
+        )
+        while not self._is_stopping:
+            if self._is_restarting: self._restart_workers()
+            self._respawn_dead_workers()
+            time.sleep(WATCH_INTERVAL)
+
+        self._stop_workers(self._workers)
+
+
+def run(app_factory: Callable, config: dict) -> None:
+    """
+    Run the application in one process or in configured number of worker
+    processes
+    """
+    server_conf = config.get('server', {})
+    if get_workers_count(config) == 1:
+        web.run_app(
+            app_factory(get_worker_config(config, 1)),
+            host=server_conf.get('host'),
+            port=server_conf.get('port')
+        )
+    else:
+        WorkersManager(app_factory, config).run()
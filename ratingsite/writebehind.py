@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable
+
+from .metrics import REGISTRY, Counter, Gauge, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_DEFAULTS = {
+    'enabled': False, 'maxsize': 10000, 'writers': 2, 'batch_size': 500
+}
+
+WRITE_LAG = REGISTRY.register(Histogram(
+    'ratingsite_write_behind_lag_seconds',
+    'Time from queueing a write to its commit', ('handler',)
+))
+
+FAILED_WRITES = REGISTRY.register(Counter(
+    'ratingsite_write_behind_failed_total',
+    'Queued writes dropped because their batch failed', ('handler',)
+))
+
+# Handler writes a batch of queued items with the connection:
+# handler(app, conn, items)
+WriteHandler = Callable[[Any, Any, list], Awaitable[None]]
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue of non-critical writes drained by writer
+    tasks. Every writer takes all pending items (up to `batch_size`) and
+    passes items of the same handler to it at once, so the handler can
+    write them with one statement on one connection. Producers wait when
+    the queue is full
+    """
+
+    def __init__(self, app, maxsize: int, writers: int,
+            batch_size: int) -> None:
+        self._app = app
+        self._queue = asyncio.Queue(maxsize)
+        self._writers_count = writers
+        self._batch_size = batch_size
+        self._writers = []
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    async def put(self, handler: WriteHandler, item: Any) -> None:
+        """Queue the item to be written by the handler"""
+        await self._queue.put((handler, item, time.perf_counter()))
+
+    async def _write_batch(self, handler: WriteHandler,
+            entries: list[tuple]) -> None:
+        """
+        Write the batch, if it fails write its items one by one, so one
+        bad item doesn't drop the others
+        """
+        try:
+            async with self._app['db'].acquire() as conn:
+                await handler(
+                    self._app, conn, [item for item, _ in entries]
+                )
+        except Exception:
+            if len(entries) == 1:
+                # Writes are already acknowledged, so they can only be
+                # logged
+                logger.exception('Write-behind item of %s failed', handler)
+                FAILED_WRITES.inc(handler.__name__)
+                return
+            logger.exception(
+                'Write-behind batch of %s failed, writing its items one by '
+                'one', handler
+            )
+        else:
+            written_at = time.perf_counter()
+            for _, queued_at in entries:
+                WRITE_LAG.observe(written_at - queued_at, handler.__name__)
+            return
+
+        for entry in entries:
+            await self._write_batch(handler, [entry])
+
+    async def _run_writer(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            entries_by_handler = defaultdict(list)
+            for handler, item, queued_at in batch:
+                entries_by_handler[handler].append((item, queued_at))
+            try:
+                for handler, entries in entries_by_handler.items():
+                    await self._write_batch(handler, entries)
+            finally:
+                for _ in batch: self._queue.task_done()
+
+    def start(self) -> None:
+        self._writers = [
+            asyncio.create_task(self._run_writer())
+            for _ in range(self._writers_count)
+        ]
+
+    async def close(self) -> None:
+        """Write all queued items and stop writers"""
+        await self._queue.join()
+        for writer in self._writers:
+            writer.cancel()
+        await asyncio.gather(*self._writers, return_exceptions=True)
+
+
+async def write_behind_context(app):
+    conf = dict(
+        WRITE_BEHIND_DEFAULTS, **app['config'].get('write_behind', {})
+    )
+    app['write_behind'] = None
+    if not conf['enabled']:
+        yield
+        return
+
+    queue = WriteBehindQueue(
+        app, conf['maxsize'], conf['writers'], conf['batch_size']
+    )
+    REGISTRY.register(Gauge(
+        'ratingsite_write_behind_queue_size',
+        'Number of queued not written items', queue.qsize
+    ))
+    queue.start()
+    app['write_behind'] = queue
+
+    yield
+
+    # Cleanup contexts are closed in reverse order, so the database, the
+    # cache and the graph used by handlers are still available here
+    await queue.close()
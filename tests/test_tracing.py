@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+from ratingsite.queries import QUERIES
+from ratingsite.tracing import (
+    QueryTracer, TracedConnection, Trace, create_tracing_middleware,
+    current_trace
+)
+from users.db import users
+
+
+USER_QUERY = QUERIES.register('test_tracing_user', select(users.c.id).where(
+    users.c.nickname == bindparam('nickname')
+))
+
+
+class FakeCursor:
+
+    def __init__(self, rows: list) -> None:
+        self._rows = rows
+
+    async def fetchall(self) -> list:
+        return self._rows
+
+
+class RawConnection:
+    """psycopg2 connection tracked by QUERIES"""
+
+
+class FakeConnection:
+    """aiopg.sa connection executing nothing and recording statements"""
+
+    def __init__(self) -> None:
+        self._dialect = PGDialect_psycopg2()
+        self.connection = RawConnection()
+        self.executed = []
+
+    async def execute(self, query, *multiparams, **params):
+        self.executed.append((query, multiparams))
+        return FakeCursor([('Index Scan using users_nickname_key',)])
+
+
+def test_slow_prepared_query_is_logged_with_sql_and_explained(caplog):
+    conn = FakeConnection()
+    traced_conn = TracedConnection(conn, QueryTracer(0, explain=True))
+    with caplog.at_level(logging.WARNING, 'ratingsite.tracing'):
+        asyncio.run(QUERIES.execute(traced_conn, USER_QUERY, nickname='x'))
+
+    assert (
+        'EXPLAIN ' + USER_QUERY.execute_sql, ({'nickname': 'x'},)
+    ) in conn.executed
+    explained_logs = [
+        record.getMessage() for record in caplog.records
+        if 'Index Scan' in record.getMessage()
+    ]
+    assert len(explained_logs) == 1
+    assert f': {USER_QUERY.sql} ' in explained_logs[0]
+
+
+def test_prepared_query_span_has_compiled_sql():
+    conn = FakeConnection()
+    traced_conn = TracedConnection(conn, QueryTracer())
+    trace = Trace()
+
+    async def execute():
+        token = current_trace.set(trace)
+        try:
+            await QUERIES.execute(traced_conn, USER_QUERY, nickname='x')
+        finally:
+            current_trace.reset(token)
+
+    asyncio.run(execute())
+
+    statements = [span['statement'] for span in trace.to_dict()['spans']]
+    assert USER_QUERY.sql in statements
+
+
+def test_streamed_response_is_not_replaced_with_profile():
+    streamed_responses = []
+    returned_responses = []
+
+    async def can_profile(request):
+        return True
+
+    async def stream(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(b'{"id": 1}\n')
+        await response.write_eof()
+        streamed_responses.append(response)
+        return response
+
+    @web.middleware
+    async def record_middleware(request, handler):
+        response = await handler(request)
+        returned_responses.append(response)
+        return response
+
+    async def get_body() -> bytes:
+        app = web.Application(middlewares=[
+            record_middleware, create_tracing_middleware(can_profile)
+        ])
+        app['config'] = {}
+        app.router.add_get('/', stream)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get('/?profile=1')
+            return await response.read()
+
+    assert asyncio.run(get_body()) == b'{"id": 1}\n'
+    assert returned_responses == streamed_responses
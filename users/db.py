@@ -1,10 +1,43 @@
 from sqlalchemy import (
-    MetaData, Table, Column, ForeignKey, Integer, String, Boolean,
-    UniqueConstraint
+    MetaData, Table, Column, ForeignKey, Integer, String, Unicode, Boolean,
+    UniqueConstraint, Index, TypeDecorator, func
 )
-from sqlalchemy_utils import EmailType
 
 
+class EmailType(TypeDecorator):
+    """
+    Email stored in lower case and compared case insensitively. Same as
+    sqlalchemy_utils.EmailType, which import takes longer than the whole
+    app startup because it pulls in sqlalchemy.orm
+    """
+
+    impl = Unicode(255)
+    cache_ok = True
+
+    class comparator_factory(Unicode.Comparator):
+
+        def __eq__(self, other):
+            if other is not None: other = func.lower(other)
+            return super().__eq__(other)
+
+        def __ne__(self, other):
+            if other is not None: other = func.lower(other)
+            return super().__ne__(other)
+
+    def process_bind_param(self, value, dialect):
+        if value is not None: return value.lower()
+        return value
+
+
+# Channel of "first_id,second_id" notifications about added friends
+FRIENDS_CHANNEL = 'users_friends'
+
+# Channel of "id,nickname" notifications about registered users
+USERS_CHANNEL = 'users_registered'
+
+# Channel of emails notifications about registered users
+LOGINS_CHANNEL = 'users_logins'
+
 meta = MetaData()
 
 users_friends_association = Table(
@@ -13,6 +46,7 @@ users_friends_association = Table(
     Column('first_id', ForeignKey('users.id', ondelete='CASCADE')),
     Column('second_id', ForeignKey('users.id', ondelete='CASCADE')),
     UniqueConstraint('first_id', 'second_id'),
+    Index('ix_users_friends_association_second_id', 'second_id'),
 )
 
 users = Table(
@@ -27,3 +61,23 @@ users = Table(
     Column('is_superuser', Boolean, nullable=False, default=False),
     Column('disabled', Boolean, nullable=False, default=False),
 )
+
+# Trigram indexes for ILIKE '%term%' and similarity() search (pg_trgm)
+Index(
+    'ix_users_nickname_trgm', users.c.nickname,
+    postgresql_using='gin', postgresql_ops={'nickname': 'gin_trgm_ops'}
+)
+Index(
+    'ix_users_first_name_trgm', users.c.first_name,
+    postgresql_using='gin', postgresql_ops={'first_name': 'gin_trgm_ops'}
+)
+Index(
+    'ix_users_last_name_trgm', users.c.last_name,
+    postgresql_using='gin', postgresql_ops={'last_name': 'gin_trgm_ops'}
+)
+# B-tree index for case insensitive nickname prefix search (LIKE 'term%')
+Index(
+    'ix_users_nickname_lower_prefix',
+    func.lower(users.c.nickname).label('lower_nickname'),
+    postgresql_ops={'lower_nickname': 'text_pattern_ops'}
+)
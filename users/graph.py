@@ -0,0 +1,157 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from sqlalchemy import tuple_
+
+from ratingsite.notifications import NotificationListener
+from .db import users_friends_association, FRIENDS_CHANNEL
+
+
+GRAPH_LOAD_CHUNK_SIZE = 50000
+
+SUGGESTIONS_DEFAULT_LIMIT = 20
+
+SUGGESTIONS_MAX_LIMIT = 100
+
+# Max friends of friends links scanned for suggestions, so friends with
+# huge numbers of friends can't make a suggestions request slow
+SUGGESTIONS_MAX_SCANNED = 100000
+
+
+def _contains(ids: array, value: int) -> bool:
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+class FriendshipGraph:
+    """
+    In-process friendship links: sorted arrays of 32-bit ids of users
+    added to friends by every user. Like in users_friends_association
+    users are friends if both of them added each other, so friendship
+    checks are two binary searches
+    """
+
+    def __init__(self) -> None:
+        self._links = {}
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    @property
+    def links_count(self) -> int:
+        return sum(len(ids) for ids in self._links.values())
+
+    def reset(self, links: dict[int, array]) -> None:
+        """Replace all links with sorted arrays of added users ids"""
+        self._links = links
+
+    def add_link(self, first_id: int, second_id: int) -> None:
+        """Add the link of user `first_id` added `second_id` to friends"""
+        ids = self._links.get(first_id)
+        if ids is None:
+            self._links[first_id] = array('i', [second_id])
+            return
+        index = bisect_left(ids, second_id)
+        if index < len(ids) and ids[index] == second_id: return
+        ids.insert(index, second_id)
+
+    def has_link(self, first_id: int, second_id: int) -> bool:
+        ids = self._links.get(first_id)
+        return ids is not None and _contains(ids, second_id)
+
+    def are_friends(self, first_id: int, second_id: int) -> bool:
+        return (
+            self.has_link(first_id, second_id) and
+            self.has_link(second_id, first_id)
+        )
+
+    def get_friends(self, user_id: int) -> list[int]:
+        """Get ids of the user friends in ascending order"""
+        return [
+            friend_id for friend_id in self._links.get(user_id, ())
+            if self.has_link(friend_id, user_id)
+        ]
+
+    def count_friends(self, user_id: int) -> int:
+        return len(self.get_friends(user_id))
+
+    def get_mutual_friends(self, first_id: int, second_id: int) -> list[int]:
+        """Get ids of common friends of the users in ascending order"""
+        second_friends = set(self.get_friends(second_id))
+        return [
+            friend_id for friend_id in self.get_friends(first_id)
+            if friend_id in second_friends
+        ]
+
+    def suggest_friends(self, user_id: int,
+            limit: int = SUGGESTIONS_DEFAULT_LIMIT) -> list[tuple[int, int]]:
+        """
+        Get up to `limit` (user_id, mutual friends count) of friends of
+        the user friends not added by the user yet, ordered by the count
+        descending, then by id
+        """
+        mutual_counts = Counter()
+        scanned = 0
+        for friend_id in self.get_friends(user_id):
+            for candidate_id in self.get_friends(friend_id):
+                if candidate_id == user_id: continue
+                if self.has_link(user_id, candidate_id): continue
+                mutual_counts[candidate_id] += 1
+            scanned += len(self._links.get(friend_id, ()))
+            if scanned >= SUGGESTIONS_MAX_SCANNED: break
+        return sorted(
+            mutual_counts.items(), key=lambda item: (-item[1], item[0])
+        )[:limit]
+
+
+async def load_links(conn) -> dict[int, array]:
+    """Load all friendship links chunk by chunk"""
+    link = users_friends_association.c
+    links = {}
+    after = (0, 0)
+    while True:
+        query = users_friends_association.select().where(
+            tuple_(link.first_id, link.second_id) > after
+        ).order_by(link.first_id, link.second_id).limit(
+            GRAPH_LOAD_CHUNK_SIZE
+        )
+        cursor = await conn.execute(query)
+        chunk = await cursor.fetchall()
+        # Links are ordered, so every array is filled in ascending order
+        for first_id, second_id in chunk:
+            ids = links.get(first_id)
+            if ids is None: ids = links[first_id] = array('i')
+            ids.append(second_id)
+        if len(chunk) < GRAPH_LOAD_CHUNK_SIZE: return links
+        after = tuple(chunk[-1])
+
+
+async def friendship_graph_context(app):
+    conf = app['config'].get('friendship_graph', {})
+    app['friendship_graph'] = None
+    if not conf.get('enabled', False):
+        yield
+        return
+
+    # Links added by other workers come with notifications sent by
+    # add_user_friend
+    graph = FriendshipGraph()
+
+    async def load(conn) -> None:
+        graph.reset(await load_links(conn))
+
+    async def handle(payloads: list[str]) -> None:
+        for payload in payloads:
+            first_id, second_id = map(int, payload.split(','))
+            graph.add_link(first_id, second_id)
+
+    listener = NotificationListener(
+        app['db'], app['config']['postgres'], FRIENDS_CHANNEL, load, handle
+    )
+    await listener.start()
+    app['friendship_graph'] = graph
+
+    yield
+
+    await listener.close()
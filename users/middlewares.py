@@ -1,13 +1,67 @@
-from aiohttp import web
+import jwt
+from aiohttp import web, hdrs
 from aiohttp_security.api import IDENTITY_KEY
 
+from ratingsite.tracing import trace_span
+from .services import is_superuser
+
+
+PUBLIC_PATH_PREFIXES = ('/api/v1/doc',)
+
+
+def skip_authentication(handler):
+    """
+    Mark handler (function or view class) as public, so the request user
+    isn't identified for it and `request.user` is always None
+    """
+    handler.skip_authentication = True
+    return handler
+
+
+def _is_public(request) -> bool:
+    """Check does the request route skip authentication"""
+    handler = request.match_info.handler
+    return (
+        getattr(handler, 'skip_authentication', False) or
+        request.path.startswith(PUBLIC_PATH_PREFIXES)
+    )
+
+
+async def _identify(request):
+    """
+    Get the JWT payload from the identity cache, or verify the token and
+    cache the payload until the token expires
+    """
+    token = request.headers.get(hdrs.AUTHORIZATION)
+    if not token: return None
+    identity_cache = request.app['identity_cache']
+    payload = identity_cache.get(token)
+    if payload is None:
+        payload = await request.app[IDENTITY_KEY].identify(request)
+        identity_cache.set(token, payload, payload.get('exp'))
+
+    return payload
+
+
+async def is_request_superuser(request) -> bool:
+    """
+    Check is the request user an active superuser. Middlewares before the
+    authentication can return responses before `request.user` is set
+    """
+    user = getattr(request, 'user', None)
+    if not user: return False
+    async with request.app['db'].acquire() as conn:
+        return await is_superuser(conn, user['id'])
+
 
 @web.middleware
 async def authentication_middleware(request, handler):
-    payload = await request.app[IDENTITY_KEY].identify(request)
-    if payload:
-        request.user = payload
-    else:
-        request.user = None
+    request.user = None
+    if not _is_public(request):
+        try:
+            with trace_span('auth'):
+                request.user = await _identify(request)
+        except (jwt.InvalidTokenError, ValueError):
+            return web.json_response({'error': 'Invalid token'}, status=401)
 
     return await handler(request)
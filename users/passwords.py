@@ -0,0 +1,149 @@
+import asyncio
+import os
+import secrets
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from ratingsite.metrics import REGISTRY, Gauge
+
+
+# passlib is imported on the first hashing (in executor worker processes
+# with the process executor), it isn't needed for the app startup
+
+# pbkdf2_sha256 rounds of passlib 1.7
+DEFAULT_ROUNDS = 29000
+
+
+def _get_pbkdf2_sha256(rounds: int):
+    from passlib.hash import pbkdf2_sha256
+    return pbkdf2_sha256.using(rounds=rounds)
+
+
+def hash_password(password: str, rounds: int = DEFAULT_ROUNDS) -> str:
+    """Hash password with pbkdf2_sha256"""
+    return _get_pbkdf2_sha256(rounds).hash(password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Verify password against pbkdf2_sha256 hash"""
+    from passlib.hash import pbkdf2_sha256
+    return pbkdf2_sha256.verify(password, password_hash)
+
+
+def verify_and_update_password(password: str, password_hash: str,
+        rounds: int = DEFAULT_ROUNDS) -> tuple[bool, Optional[str]]:
+    """
+    Verify password against pbkdf2_sha256 hash. Return is it verified and
+    the new hash with `rounds` if the hash has other rounds, else None
+    """
+    handler = _get_pbkdf2_sha256(rounds)
+    if not handler.verify(password, password_hash): return False, None
+    if not handler.needs_update(password_hash): return True, None
+    return True, handler.hash(password)
+
+
+class PasswordHasher:
+    """
+    Hasher running CPU heavy password hashing in executor (outside of the
+    event loop) with limited number of concurrent hashings
+    """
+
+    def __init__(self, executor: Executor, max_concurrency: int,
+            rounds: int = DEFAULT_ROUNDS) -> None:
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rounds = rounds
+        self._dummy_hash = None
+        self._queue_depth = 0
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of hashings waiting for a free executor slot"""
+        return self._queue_depth
+
+    @property
+    def in_flight(self) -> int:
+        """Number of hashings running in executor"""
+        return self._in_flight
+
+    def register_metrics(self) -> None:
+        """Register queue depth and in flight gauges"""
+        REGISTRY.register(Gauge(
+            'ratingsite_password_hashing_queue_depth',
+            'Number of password hashings waiting for executor',
+            lambda: self._queue_depth
+        ))
+        REGISTRY.register(Gauge(
+            'ratingsite_password_hashing_in_flight',
+            'Number of password hashings running in executor',
+            lambda: self._in_flight
+        ))
+
+    async def _run(self, func, *args):
+        """Run `func` in executor when there is a free slot"""
+        self._queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queue_depth -= 1
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        """Hash password"""
+        return await self._run(hash_password, password, self._rounds)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        """Verify password against hash"""
+        return await self._run(verify_password, password, password_hash)
+
+    async def verify_and_update(self, password: str,
+            password_hash: str) -> tuple[bool, Optional[str]]:
+        """
+        Verify password against hash, return is it verified and the new
+        hash if the hash rounds aren't the configured ones
+        """
+        return await self._run(
+            verify_and_update_password, password, password_hash,
+            self._rounds
+        )
+
+    async def get_dummy_hash(self) -> str:
+        """
+        Get hash of a random password with the configured rounds. Logins
+        of unknown users verify passwords against it, so they take as long
+        as logins of existing users
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hash(secrets.token_urlsafe())
+        return self._dummy_hash
+
+
+def create_executor(conf: dict, workers: int) -> Executor:
+    """Create process (default) or thread pool executor using config"""
+    if conf.get('executor', 'process') == 'thread':
+        return ThreadPoolExecutor(workers, 'password-hasher')
+    return ProcessPoolExecutor(workers)
+
+
+async def password_hasher_context(app):
+    conf = app['config'].get('password_hashing', {})
+    workers = conf.get('workers') or os.cpu_count()
+    executor = create_executor(conf, workers)
+    max_concurrency = conf.get('max_concurrency') or workers
+    app['password_hasher'] = PasswordHasher(
+        executor, max_concurrency, conf.get('rounds', DEFAULT_ROUNDS)
+    )
+    app['password_hasher'].register_metrics()
+
+    yield
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, executor.shutdown)
@@ -8,7 +8,12 @@ def setup_users_routes(app):
     app.router.add_view('/api/v1/login/', views.LoginView)
     app.add_routes([
         web.get('/api/v1/users/', views.all_users),
+        web.post('/api/v1/users/batch/', views.users_batch),
         web.post('/api/v1/friends/add/', views.add_friend),
+        web.post('/api/v1/friends/add/batch/', views.add_friends_batch),
+        web.get(
+            '/api/v1/friends/suggestions/', views.friend_suggestions
+        ),
         web.get('/api/v1/friends/{user_nickname}/', views.get_user_friends),
         web.get('/api/v1/users/current/', views.current_user_info),
         web.get('/api/v1/users/search/{search_by}/', views.search_users),
@@ -0,0 +1,119 @@
+from typing import Optional
+
+from ratingsite.notifications import NotificationListener
+from .db import users, USERS_CHANNEL
+
+
+TRIE_LOAD_CHUNK_SIZE = 10000
+
+
+class _TrieNode:
+
+    __slots__ = ('children', 'user_ids')
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.user_ids = None
+
+
+class NicknameTrie:
+    """In-process case insensitive prefix trie of users nicknames"""
+
+    def __init__(self) -> None:
+        self._root = _TrieNode()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def reset(self, trie: 'NicknameTrie') -> None:
+        """Replace all nicknames with nicknames of the trie"""
+        self._root = trie._root
+        self._size = trie._size
+
+    def insert(self, nickname: str, user_id: int) -> None:
+        """Add the user nickname into the trie"""
+        node = self._root
+        for char in nickname.lower():
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+            node = child
+        if node.user_ids is None: node.user_ids = []
+        if user_id in node.user_ids: return
+        node.user_ids.append(user_id)
+        self._size += 1
+
+    def _find_node(self, prefix: str) -> Optional[_TrieNode]:
+        """Get the node for the prefix or None if there is no such prefix"""
+        node = self._root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None: return None
+        return node
+
+    def complete(self, prefix: str, limit: int) -> list[int]:
+        """
+        Get ids of up to `limit` users whose nicknames start with `prefix`
+        in the nicknames alphabetical order
+        """
+        node = self._find_node(prefix)
+        if node is None: return []
+        user_ids = []
+        stack = [node]
+        while stack and len(user_ids) < limit:
+            node = stack.pop()
+            if node.user_ids: user_ids.extend(node.user_ids)
+            stack.extend(
+                node.children[char]
+                for char in sorted(node.children, reverse=True)
+            )
+        return user_ids[:limit]
+
+
+async def load_nickname_trie(conn) -> NicknameTrie:
+    """Load nicknames of all users into a new trie chunk by chunk"""
+    trie = NicknameTrie()
+    after_id = 0
+    while True:
+        query = users.select().with_only_columns([
+            users.c.id, users.c.nickname
+        ]).where(users.c.id > after_id).order_by(users.c.id).limit(
+            TRIE_LOAD_CHUNK_SIZE
+        )
+        cursor = await conn.execute(query)
+        chunk = await cursor.fetchall()
+        for user in chunk:
+            trie.insert(user.nickname, user.id)
+        if len(chunk) < TRIE_LOAD_CHUNK_SIZE: return trie
+        after_id = chunk[-1].id
+
+
+async def nickname_trie_context(app):
+    search_conf = app['config'].get('search', {})
+    app['nickname_trie'] = None
+    if not search_conf.get('nickname_trie', False):
+        yield
+        return
+
+    # Users registered by other workers come with notifications sent by
+    # RegistrationService
+    trie = NicknameTrie()
+
+    async def load(conn) -> None:
+        trie.reset(await load_nickname_trie(conn))
+
+    async def handle(payloads: list[str]) -> None:
+        for payload in payloads:
+            user_id, nickname = payload.split(',', 1)
+            trie.insert(nickname, int(user_id))
+
+    listener = NotificationListener(
+        app['db'], app['config']['postgres'], USERS_CHANNEL, load, handle
+    )
+    await listener.start()
+    app['nickname_trie'] = trie
+
+    yield
+
+    await listener.close()
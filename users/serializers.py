@@ -1,6 +1,15 @@
 import re
+from typing import Optional
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, conint, root_validator, validator
+
+
+USERS_BATCH_MAX_SIZE = 100
+
+FRIENDS_BATCH_MAX_SIZE = 1000
+
+# Users ids are Postgres integers, booleans aren't ids
+UserId = conint(strict=True, gt=0, le=2 ** 31 - 1)
 
 
 class RegistrationData(BaseModel):
@@ -74,3 +83,52 @@ class UserSerializer(BaseModel):
     first_name: str
     last_name: str
     is_superuser: bool
+
+
+class UsersBatchData(BaseModel):
+    """PyDantic model for batch users lookup data"""
+
+    ids: Optional[list[UserId]]
+    nicknames: Optional[list[str]]
+
+    @root_validator
+    def validate_one_of_keys(cls, values: dict) -> dict:
+        """
+        Validate is there exactly one of ids and nicknames with
+        1 <= length <= USERS_BATCH_MAX_SIZE
+        """
+        keys = [
+            values[name] for name in ('ids', 'nicknames')
+            if values.get(name) is not None
+        ]
+        if len(keys) != 1:
+            raise ValueError('Either ids or nicknames should be passed')
+        if not 0 < len(keys[0]) <= USERS_BATCH_MAX_SIZE:
+            raise ValueError(
+                f'Batch size should be between 1 and {USERS_BATCH_MAX_SIZE}'
+            )
+
+        return values
+
+
+class FriendData(BaseModel):
+    """PyDantic model for friend adding data"""
+
+    id: UserId
+
+
+class FriendsBatchData(BaseModel):
+    """PyDantic model for batch friends adding data"""
+
+    ids: list[UserId]
+
+    @validator('ids')
+    def validate_batch_size(cls, value: list[int]) -> list[int]:
+        """Validate is 1 <= length <= FRIENDS_BATCH_MAX_SIZE"""
+        if not 0 < len(value) <= FRIENDS_BATCH_MAX_SIZE:
+            raise ValueError(
+                f'Batch size should be between 1 and '
+                f'{FRIENDS_BATCH_MAX_SIZE}'
+            )
+
+        return value
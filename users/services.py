@@ -1,80 +1,350 @@
-from typing import Union
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional, Union
 
 import jwt
-from passlib.hash import pbkdf2_sha256
 from aiohttp.web import Request
-from sqlalchemy import and_, or_
-
+from sqlalchemy import (
+    and_, or_, func, select, null, text, literal_column, any_, bindparam,
+    Integer, String
+)
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, insert
+
+from ratingsite.cache import LRUCache
+from ratingsite.db import fetch_dicts, remember_writes
+from ratingsite.metrics import timed
+from ratingsite.notifications import NotificationListener
+from ratingsite.queries import QUERIES
 from ratingsite.settings import config
-from ratings.services import GetUserRatingService
-from .db import users, users_friends_association
-from .serializers import RegistrationData, LoginData, UserSerializer
+from ratingsite.workers import get_workers_count
+from ratings.db import ratings
+from ratings.services import get_empty_rating_stats, rating_stats_json
+from .db import (
+    users, users_friends_association, FRIENDS_CHANNEL, USERS_CHANNEL,
+    LOGINS_CHANNEL
+)
+from .graph import FriendshipGraph, SUGGESTIONS_DEFAULT_LIMIT
+from .passwords import PasswordHasher
+from .search import NicknameTrie
+from .serializers import RegistrationData, LoginData, FriendData
+
+
+JWT_DEFAULT_LIFETIME = 24 * 60 * 60
+
+# Columns of UserSerializer. Rows of them are read from our own schema, so
+# they are returned as dicts without validation by UserSerializer
+USER_COLUMNS = [
+    users.c.id, users.c.nickname, users.c.first_name, users.c.last_name,
+    users.c.is_superuser
+]
+
+
+def encode_jwt_token(jwt_payload: dict) -> str:
+    """Encode JWT token with payload expiring after configured lifetime"""
+    lifetime = config.get('jwt_lifetime', JWT_DEFAULT_LIFETIME)
+    jwt_payload = dict(
+        jwt_payload, exp=datetime.now(tz=timezone.utc) + timedelta(
+            seconds=lifetime
+        )
+    )
+    return jwt.encode(jwt_payload, config['jwt_secret'])
+
+
+USER_BY_NICKNAME_QUERY = QUERIES.register('user_by_nickname', select(
+    USER_COLUMNS
+).where(users.c.nickname == bindparam('nickname')))
+
+
+USERS_BY_IDS_QUERY = QUERIES.register('users_by_ids', select(
+    USER_COLUMNS
+).where(users.c.id == any_(bindparam('user_ids', type_=ARRAY(Integer)))))
 
 
+@timed
 async def get_user_by_nickname(conn, nickname: str):
     """Get user from DB using nickname"""
-    query = users.select().where(users.c.nickname == nickname)
-    cursor = await conn.execute(query)
+    cursor = await QUERIES.execute(
+        conn, USER_BY_NICKNAME_QUERY, nickname=nickname
+    )
     user = await cursor.fetchone()
     if not user: raise IndexError
     return user
 
 
-async def get_all_users(conn, current_user=None) -> list:
-    """Get all users from DB exclude current user (if not empty)"""
-    query = users.select().where(users.c.disabled == False)
+@timed
+async def is_superuser(conn, user_id: int) -> bool:
+    """Check is the user with `user_id` an active superuser"""
+    query = select([users.c.is_superuser]).where(and_(
+        users.c.id == user_id, users.c.disabled == False
+    ))
+    return bool(await conn.scalar(query))
+
+
+USERS_PAGE_MAX_LIMIT = 500
+
+USERS_STREAM_CHUNK_SIZE = 1000
+
+USER_INFO_FRIENDS_LIMIT = 20
+
+
+def _get_all_users_query(current_user=None, after_id: Optional[int] = None,
+        limit: Optional[int] = None):
+    """
+    Construct get all users query ordered by id, starting after
+    `after_id` (keyset pagination)
+    """
+    query = select(USER_COLUMNS).where(
+        users.c.disabled == False
+    ).order_by(users.c.id)
     if current_user:
         query = query.where(users.c.email != current_user['email'])
-
+    if after_id is not None:
+        query = query.where(users.c.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query
+
+
+@timed
+async def get_all_users(conn, current_user=None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None) -> list:
+    """
+    Get all users from DB exclude current user (if not empty). If `limit`
+    is passed return only one page of users with id greater than `after_id`
+    """
+    query = _get_all_users_query(current_user, after_id, limit)
     cursor = await conn.execute(query)
-    all_users = await cursor.fetchall()
-    json_users = [
-        UserSerializer.parse_obj(dict(user)).dict() for user in all_users
-    ]
+    json_users = await fetch_dicts(cursor)
     return json_users
 
 
-async def add_user_friend(conn, request: Request) -> None:
-    """Add the user to friends list of current user"""
+async def iter_all_users(conn, current_user=None,
+        chunk_size: int = USERS_STREAM_CHUNK_SIZE
+        ) -> AsyncIterator[list[dict]]:
+    """
+    Iterate over all users in chunks of `chunk_size` users. Every chunk is
+    fetched by a separate keyset query, so only one chunk is kept in memory
+    """
+    after_id = None
+    while True:
+        chunk = await get_all_users(conn, current_user, after_id, chunk_size)
+        if not chunk: return
+        yield chunk
+        if len(chunk) < chunk_size: return
+        after_id = chunk[-1]['id']
+
+
+@timed
+async def add_user_friend(conn, request: Request) -> Optional[str]:
+    """
+    Add the user to friends list of current user, return the added user
+    nickname
+    """
     json_request = await request.json()
     friend_id = json_request.get('id')
-    if not friend_id or request.user['id'] == friend_id: return
+    if not friend_id or request.user['id'] == friend_id: return None
     query = users_friends_association.insert({
         'first_id': request.user['id'], 'second_id': friend_id
     })
     await conn.execute(query)
+    graph = request.app['friendship_graph']
+    if graph is not None: graph.add_link(request.user['id'], int(friend_id))
+    # Graphs of other worker processes are updated by the notification
+    query = select([users.c.nickname, func.pg_notify(
+        FRIENDS_CHANNEL, f"{request.user['id']},{friend_id}"
+    )]).where(users.c.id == friend_id)
+    return await conn.scalar(query)
+
+
+def _get_friend_links_insert_query():
+    """
+    Construct insert of friend links passed as `first_ids` and
+    `second_ids` arrays skipping existing links and links of nonexistent
+    users. Returns added links with nicknames and notifies about them
+    """
+    ids_type = ARRAY(Integer)
+    links = select([
+        func.unnest(bindparam('first_ids', type_=ids_type)).label('first_id'),
+        func.unnest(bindparam('second_ids', type_=ids_type)).label(
+            'second_id'
+        ),
+    ]).subquery('links')
+    first_user = users.alias('first_user')
+    second_user = users.alias('second_user')
+    added = insert(users_friends_association).from_select(
+        ['first_id', 'second_id'],
+        select([links.c.first_id, links.c.second_id]).select_from(
+            links.join(first_user, first_user.c.id == links.c.first_id)
+            .join(second_user, second_user.c.id == links.c.second_id)
+        )
+    ).on_conflict_do_nothing().returning(
+        users_friends_association.c.first_id,
+        users_friends_association.c.second_id
+    ).cte('added')
+    return select([
+        added.c.first_id, added.c.second_id,
+        first_user.c.nickname.label('first_nickname'),
+        second_user.c.nickname.label('second_nickname'),
+        # Prepared statement parameters of concat can't get a type
+        func.pg_notify(FRIENDS_CHANNEL, func.concat(
+            added.c.first_id, literal_column("','"), added.c.second_id
+        )),
+    ]).select_from(
+        added.join(first_user, first_user.c.id == added.c.first_id)
+        .join(second_user, second_user.c.id == added.c.second_id)
+    )
+
+
+FRIEND_LINKS_INSERT_QUERY = QUERIES.register(
+    'friend_links_insert', _get_friend_links_insert_query()
+)
+
+
+async def queue_user_friend(request: Request) -> bool:
+    """
+    Queue adding the user to friends list of current user in the write
+    behind queue. Return is the user queued, raise ValueError if the
+    user ID isn't a valid id, so it can't fail the queued batch
+    """
+    json_request = await request.json()
+    if not json_request.get('id'): return False
+    friend_id = FriendData.parse_obj(json_request).id
+    if request.user['id'] == friend_id: return False
+    await request.app['write_behind'].put(
+        write_friend_links, (request.user['id'], friend_id)
+    )
+    return True
+
+
+async def write_friend_links(app, conn, links: list[tuple[int, int]]):
+    """
+    Write-behind handler inserting queued friend links with one statement
+    and updating the friendship graph and responses cache
+    """
+    links = list(dict.fromkeys(links))
+    cursor = await QUERIES.execute(
+        conn, FRIEND_LINKS_INSERT_QUERY,
+        first_ids=[first_id for first_id, _ in links],
+        second_ids=[second_id for _, second_id in links]
+    )
+    added = await cursor.fetchall()
+    graph = app['friendship_graph']
+    if graph is not None:
+        for link in added: graph.add_link(link.first_id, link.second_id)
+    nicknames = {
+        nickname for link in added
+        for nickname in (link.first_nickname, link.second_nickname)
+    }
+    await app['response_cache'].invalidate(*nicknames)
+    remember_writes(app, *nicknames)
+
+
+def _get_add_friend_result(friend_id: int, user_id: int, seen_ids: set,
+        nicknames: dict, added_ids: set) -> str:
+    if friend_id in seen_ids: return 'duplicate'
+    if friend_id == user_id: return 'self'
+    if friend_id not in nicknames: return 'not_found'
+    if friend_id in added_ids: return 'added'
+    return 'already_added'
+
+
+@timed
+async def add_user_friends(conn, request: Request,
+        friend_ids: list[int]) -> tuple[list[dict], list[str]]:
+    """
+    Add users to friends list of current user with one existence check
+    and one insert. Return the result of every passed id (added,
+    already_added, not_found, self or duplicate) and nicknames of added
+    users
+    """
+    user_id = request.user['id']
+    unique_ids = list(dict.fromkeys(friend_ids))
+    cursor = await QUERIES.execute(
+        conn, USERS_BY_IDS_QUERY, user_ids=unique_ids
+    )
+    nicknames = {user.id: user.nickname for user in await cursor.fetchall()}
+    new_ids = [
+        friend_id for friend_id in unique_ids
+        if friend_id in nicknames and friend_id != user_id
+    ]
+    added_ids = set()
+    if new_ids:
+        cursor = await QUERIES.execute(
+            conn, FRIEND_LINKS_INSERT_QUERY,
+            first_ids=[user_id] * len(new_ids), second_ids=new_ids
+        )
+        added_ids = {link.second_id for link in await cursor.fetchall()}
+
+    graph = request.app['friendship_graph']
+    if graph is not None:
+        for friend_id in added_ids: graph.add_link(user_id, friend_id)
+
+    results = []
+    seen_ids = set()
+    for friend_id in friend_ids:
+        results.append({'id': friend_id, 'result': _get_add_friend_result(
+            friend_id, user_id, seen_ids, nicknames, added_ids
+        )})
+        seen_ids.add(friend_id)
+    return results, [nicknames[friend_id] for friend_id in added_ids]
 
 
+@timed
 async def get_user_info(conn, user_nickname: str) -> dict:
-    """Get information (id, nickname, is_superuser, friends) about user"""
+    """
+    Get information (id, nickname, is_superuser, friends) about user.
+    Only the first page of friends is returned, `friends_next_after_id`
+    is the `after_id` of the next friends page or None
+    """
     user = await get_user_by_nickname(conn, user_nickname)
-    json_user = UserSerializer.parse_obj(dict(user)).dict()
+    json_user = dict(user)
     get_friends_service = GetUserFriendsService(conn)
-    user_friends = await get_friends_service.get_friends_by_id(user.id)
+    user_friends = await get_friends_service.get_friends_by_id(
+        user.id, limit=USER_INFO_FRIENDS_LIMIT
+    )
     json_user['friends'] = user_friends
+    json_user['friends_next_after_id'] = (
+        user_friends[-1]['id']
+        if len(user_friends) == USER_INFO_FRIENDS_LIMIT else None
+    )
     return json_user
 
 
 class RegistrationService:
     """Service with registration logic"""
 
-    def __init__(self, conn):
+    def __init__(self, conn, password_hasher: PasswordHasher,
+            nickname_trie: Optional[NicknameTrie] = None):
         self._conn = conn
+        self._password_hasher = password_hasher
+        self._nickname_trie = nickname_trie
 
-    def _get_query_data(self, auth_data: RegistrationData) -> dict:
+    async def _get_query_data(self, auth_data: RegistrationData) -> dict:
         """
         Get data for query with password field with hashed password
         instead of password1 and password2 fields
         """
-        password = pbkdf2_sha256.hash(auth_data.password1)
+        password = await self._password_hasher.hash(auth_data.password1)
         query_data = auth_data.dict(exclude={'password1', 'password2'})
         query_data['password'] = password
         return query_data
 
     async def _create_db_user(self, auth_data: RegistrationData) -> int:
         """Create a new entry in DB and return new user id"""
-        auth_data_dict = self._get_query_data(auth_data)
-        query = users.insert().values(**auth_data_dict)
+        auth_data_dict = await self._get_query_data(auth_data)
+        # Login caches of other worker processes forget the unknown email
+        # with the notification
+        columns = [users.c.id, func.pg_notify(LOGINS_CHANNEL, users.c.email)]
+        if self._nickname_trie is not None:
+            # Tries of other worker processes are updated by the
+            # notification
+            columns.append(func.pg_notify(
+                USERS_CHANNEL, func.concat(
+                    users.c.id, literal_column("','"), users.c.nickname
+                )
+            ))
+        query = users.insert().values(**auth_data_dict).returning(*columns)
         cursor = await self._conn.execute(query)
         created_user_id = await cursor.fetchone()
         return created_user_id[0]
@@ -84,136 +354,502 @@ class RegistrationService:
         """Generate jwt token for user"""
         jwt_payload = auth_data.dict(include={'nickname', 'email'})
         jwt_payload.update({'id': user_id})
-        jwt_token = jwt.encode(jwt_payload, config['jwt_secret'])
+        jwt_token = encode_jwt_token(jwt_payload)
         return jwt_token
 
+    @timed
     async def registrate_user(self, auth_data: RegistrationData) -> dict:
         """
         Registrate user: create the user entry in DB and the JWT token,
         return the created jwt token, error data
         """
         created_user_id = await self._create_db_user(auth_data)
-        jwt_token = self._get_jwt_token(auth_data, created_user_id)
+        if self._nickname_trie is not None:
+            self._nickname_trie.insert(auth_data.nickname, created_user_id)
+        jwt_token = await self._get_jwt_token(auth_data, created_user_id)
         return {'jwt_token': jwt_token}
 
 
-class LoginService:
-    """Service with log in logic"""
+LOGIN_USER_BY_EMAIL_QUERY = QUERIES.register(
+    'login_user_by_email', select([
+        users.c.id, users.c.email, users.c.nickname, users.c.password,
+        users.c.disabled
+    ]).where(users.c.email == bindparam('email'))
+)
 
-    def __init__(self, conn):
-        self._conn = conn
 
-    async def _get_user(self, email: str):
-        """Get user by email"""
-        query = users.select().where(
-            and_(users.c.email == email, users.c.disabled == False)
-        )
-        cursor = await self._conn.execute(query)
-        user = await cursor.fetchone()
-        return user
+# Cached login record of unknown emails
+UNKNOWN_LOGIN = {}
+
+
+def invalidate_login(app, email: str) -> None:
+    """
+    Forget the cached login record of the email, call it on registration
+    and on password and disabled changes. Other worker processes forget
+    registered emails with notifications, their records of changed users
+    expire after the login cache TTL
+    """
+    app['login_cache'].delete(email.lower())
+
+
+async def login_cache_context(app):
+    if get_workers_count(app['config']) == 1:
+        yield
+        return
+
+    login_cache = app['login_cache']
+
+    async def load(conn) -> None:
+        # Registrations could be missed while the listener reconnected
+        login_cache.clear()
+
+    async def handle(payloads: list[str]) -> None:
+        for email in payloads:
+            login_cache.delete(email)
+
+    listener = NotificationListener(
+        app['db'], app['config']['postgres'], LOGINS_CHANNEL, load, handle
+    )
+    await listener.start()
+
+    yield
 
-    def _create_jwt_token(self, user) -> str:
+    await listener.close()
+
+
+class LoginService:
+    """
+    Service with log in logic. Login records (id, email, nickname,
+    password hash, disabled) are cached by email in `login_cache`, the
+    connection is acquired only to read missing records and to save
+    rehashed passwords, not during verification. Unknown emails are cached
+    too, so known and unknown emails take the same time to check
+    """
+
+    def __init__(self, db, password_hasher: PasswordHasher,
+            login_cache: Optional[LRUCache] = None):
+        self._db = db
+        self._password_hasher = password_hasher
+        self._login_cache = login_cache
+
+    async def _get_user(self, email: str) -> Optional[dict]:
+        """Get login record of user by email"""
+        email = email.lower()
+        if self._login_cache is not None:
+            user = self._login_cache.get(email)
+            if user is UNKNOWN_LOGIN: return None
+            if user is not None: return user
+
+        async with self._db.acquire() as conn:
+            cursor = await QUERIES.execute(
+                conn, LOGIN_USER_BY_EMAIL_QUERY, email=email
+            )
+            rows = await fetch_dicts(cursor)
+        user = rows[0] if rows else UNKNOWN_LOGIN
+        if self._login_cache is not None: self._login_cache.set(email, user)
+        return user if rows else None
+
+    async def _update_password_hash(self, user: dict,
+            password_hash: str) -> None:
+        """Save the user password rehashed with the configured rounds"""
+        query = users.update().where(and_(
+            users.c.id == user['id'], users.c.password == user['password']
+        )).values(password=password_hash)
+        async with self._db.acquire() as conn:
+            await conn.execute(query)
+        if self._login_cache is not None:
+            self._login_cache.set(
+                user['email'], dict(user, password=password_hash)
+            )
+
+    def _create_jwt_token(self, user: dict) -> str:
         """Create a new JWT token for user"""
         jwt_payload = {
-            'id': user.id, 'email': user.email, 'nickname': user.nickname
+            'id': user['id'], 'email': user['email'],
+            'nickname': user['nickname']
         }
-        jwt_token = jwt.encode(jwt_payload, config['jwt_secret'])
+        jwt_token = encode_jwt_token(jwt_payload)
         return jwt_token
 
+    @timed
     async def login_user(self, auth_data: LoginData) -> dict:
         """
-        Get user from db by `auth_data` and create a new JWT token
-        for it
+        Get user by `auth_data` email, verify the password and create a
+        new JWT token for the user. Passwords of unknown users are
+        verified against a dummy hash, so the response time doesn't tell
+        whether the user exists
         """
         user = await self._get_user(auth_data.email)
-        if not user: return {
+        if user is not None:
+            password_hash = user['password']
+        else:
+            password_hash = await self._password_hasher.get_dummy_hash()
+        is_verified, new_hash = await self._password_hasher.verify_and_update(
+            auth_data.password, password_hash
+        )
+        if user is None or user['disabled'] or not is_verified: return {
             'error': "User with these credentials doesn't exist"
         }
+        if new_hash is not None:
+            await self._update_password_hash(user, new_hash)
         jwt_token = self._create_jwt_token(user)
         return {'jwt_token': jwt_token}
 
 
+def _select_friends(friend, user_id, columns) -> tuple:
+    """
+    Construct select of `columns` of friends of the user with `user_id`
+    (users followed by the user who follow the user back) ordered by id,
+    `friend` is users table or its alias. Return the select and the
+    friend link alias.
+
+    This is one self-join of the association table, both sides use
+    (first_id, second_id) index. The select is filtered and ordered by
+    friend_link.second_id (equal to friend id), so pages are read in order
+    from the index
+    """
+    friend_link = users_friends_association.alias('friend_link')
+    back_link = users_friends_association.alias('back_link')
+    query = select(columns).select_from(friend.join(
+        friend_link, friend_link.c.second_id == friend.c.id
+    ).join(back_link, and_(
+        back_link.c.first_id == friend.c.id,
+        back_link.c.second_id == friend_link.c.first_id
+    ))).where(
+        friend_link.c.first_id == user_id
+    ).order_by(friend_link.c.second_id)
+    return query, friend_link
+
+
+def _get_user_friends_query():
+    """
+    Construct get user friends page query ordered by id. Ids start from 1,
+    so `after_id` 0 is the first page, NULL `limit` means no limit
+    """
+    query, friend_link = _select_friends(
+        users, bindparam('user_id'), USER_COLUMNS
+    )
+    return query.where(
+        friend_link.c.second_id > bindparam('after_id')
+    ).limit(bindparam('limit'))
+
+
+USER_FRIENDS_QUERY = QUERIES.register(
+    'user_friends', _get_user_friends_query()
+)
+
+
 class GetUserFriendsService:
 
     def __init__(self, conn):
         self._conn = conn
 
-    def _get_user_friends_query(self, user_id: int):
-        """Construct get user friends query"""
-        return users.select().join(
-            users_friends_association,
-            users_friends_association.c.second_id == users.c.id
-        ).where(
-            users_friends_association.c.first_id == user_id
-        ).intersect(users.select().join(
-            users_friends_association,
-            users_friends_association.c.first_id == users.c.id
-        ).where(
-            users_friends_association.c.second_id == user_id
-        ))
-
-    async def get_friends_by_id(self, user_id: int) -> list[dict]:
+    @timed
+    async def get_friends_by_id(self, user_id: int,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None) -> list[dict]:
         """Get user friends using user id"""
-        query = self._get_user_friends_query(user_id)
-        cursor = await self._conn.execute(query)
-        user_friends = await cursor.fetchall()
-        json_friends = [
-            UserSerializer.parse_obj(dict(user)).dict() for user in user_friends
-        ]
+        cursor = await QUERIES.execute(
+            self._conn, USER_FRIENDS_QUERY, user_id=user_id,
+            after_id=after_id or 0, limit=limit
+        )
+        json_friends = await fetch_dicts(cursor)
         return json_friends
 
-    async def get_friends_by_nick(self, user_nickname: str) -> list[dict]:
+    async def get_friends_by_nick(self, user_nickname: str,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None) -> list[dict]:
         """Get user friends using user nickname"""
         user = await get_user_by_nickname(self._conn, user_nickname)
-        friends = await self.get_friends_by_id(user.id)
+        friends = await self.get_friends_by_id(user.id, after_id, limit)
         return friends
 
 
+@timed
+async def get_friend_suggestions(conn, graph: FriendshipGraph, user_id: int,
+        limit: int = SUGGESTIONS_DEFAULT_LIMIT) -> list[dict]:
+    """
+    Get users who are friends of the user friends ordered by the number
+    of mutual friends (`mutual_friends`) descending
+    """
+    suggestions = graph.suggest_friends(user_id, limit)
+    if not suggestions: return []
+    cursor = await QUERIES.execute(
+        conn, USERS_BY_IDS_QUERY,
+        user_ids=[suggested_id for suggested_id, _ in suggestions]
+    )
+    users_by_id = {user['id']: user for user in await fetch_dicts(cursor)}
+    json_suggestions = []
+    for suggested_id, mutual_friends in suggestions:
+        user = users_by_id.get(suggested_id)
+        if user is None: continue
+        user['mutual_friends'] = mutual_friends
+        json_suggestions.append(user)
+    return json_suggestions
+
+
 class GetAnotherUserInfoService:
 
     def __init__(self, conn, current_user_id: Union[str, int, None]) -> None:
         self._conn = conn
         self._current_user_id = current_user_id
 
+    def _get_friends_json(self):
+        """
+        Construct correlated subquery with json array of the first page of
+        friends of the user from the outer query
+        """
+        friend = users.alias('friend')
+        friends_page, _ = _select_friends(friend, users.c.id, [
+            friend.c.id, friend.c.nickname, friend.c.first_name,
+            friend.c.last_name, friend.c.is_superuser
+        ])
+        friends_page = friends_page.limit(
+            USER_INFO_FRIENDS_LIMIT
+        ).correlate(users).subquery('friends_page')
+        return select(func.coalesce(
+            func.json_agg(aggregate_order_by(
+                literal_column('friends_page'), friends_page.c.id
+            )), text("'[]'::json")
+        )).select_from(friends_page).scalar_subquery()
+
+    def _get_rating_json(self):
+        """
+        Construct correlated subquery with json object of the current user
+        rating for the user from the outer query
+        """
+        if not self._current_user_id: return null()
+        return select(func.json_build_object(
+            'rating_value', ratings.c.rating_value,
+            'improve', ratings.c.improve
+        )).where(and_(
+            ratings.c.creator_id == self._current_user_id,
+            ratings.c.receiver_id == users.c.id
+        )).limit(1).scalar_subquery()
+
+    def _get_profiles_query(self, condition):
+        """
+        Construct query selecting users matching `condition`, the first
+        page of their friends, the current user ratings for them and their
+        rating stats in one round trip
+        """
+        return select([
+            users.c.id, users.c.nickname, users.c.first_name,
+            users.c.last_name, users.c.is_superuser,
+            self._get_friends_json().label('friends'),
+            self._get_rating_json().label('rating'),
+            rating_stats_json(users.c.id).label('rating_stats'),
+        ]).where(condition)
+
+    @staticmethod
+    def _get_user_info(profile) -> dict:
+        user_info = dict(profile)
+        if user_info['rating_stats'] is None:
+            user_info['rating_stats'] = get_empty_rating_stats()
+        user_info['friends_next_after_id'] = (
+            profile.friends[-1]['id']
+            if len(profile.friends) == USER_INFO_FRIENDS_LIMIT else None
+        )
+        return user_info
+
+    @timed
     async def get_info(self, another_user_nickname: str) -> dict:
         """Get full info (including friends and rating) about another user"""
-        user_info = await get_user_info(self._conn, another_user_nickname)
-        rating_service = GetUserRatingService(
-            self._conn, self._current_user_id
+        query = self._get_profiles_query(
+            users.c.nickname == another_user_nickname
         )
-        user_rating = await rating_service.get_user_rating(user_info['id'])
-        user_info['rating'] = user_rating
-        return user_info
+        cursor = await self._conn.execute(query)
+        profile = await cursor.fetchone()
+        if not profile: raise IndexError
+        return self._get_user_info(profile)
+
+    @timed
+    async def get_infos(self, column, values: list) -> list[dict]:
+        """
+        Get full infos of users whose `column` (id or nickname) is one of
+        `values` with one `= ANY(array)` query
+        """
+        if not values: return []
+        query = self._get_profiles_query(column == any_(bindparam(
+            'values', values, type_=ARRAY(column.type)
+        )))
+        cursor = await self._conn.execute(query)
+        profiles = await cursor.fetchall()
+        return [self._get_user_info(profile) for profile in profiles]
+
+
+class UserProfilesLoader:
+    """
+    Per-request loader of users full infos by ids and nicknames. Every
+    load is one query for all keys, duplicate keys and users already loaded
+    during the request aren't queried again
+    """
+
+    def __init__(self, conn, current_user_id: Union[str, int, None]) -> None:
+        self._service = GetAnotherUserInfoService(conn, current_user_id)
+        self._by_id = {}
+        self._by_nickname = {}
+
+    async def _load_many(self, keys: list, loaded: dict,
+            column) -> list[Optional[dict]]:
+        """Load infos by `keys`, None for keys of nonexistent users"""
+        missing = list(dict.fromkeys(
+            key for key in keys if key not in loaded
+        ))
+        for user_info in await self._service.get_infos(column, missing):
+            self._by_id[user_info['id']] = user_info
+            self._by_nickname[user_info['nickname']] = user_info
+        for key in missing:
+            loaded.setdefault(key, None)
+        return [loaded[key] for key in keys]
+
+    async def load_many_by_ids(self,
+            user_ids: list[int]) -> list[Optional[dict]]:
+        return await self._load_many(user_ids, self._by_id, users.c.id)
+
+    async def load_many_by_nicknames(self,
+            nicknames: list[str]) -> list[Optional[dict]]:
+        return await self._load_many(
+            nicknames, self._by_nickname, users.c.nickname
+        )
+
+
+SEARCH_DEFAULT_LIMIT = 20
+
+SEARCH_MAX_LIMIT = 100
+
+
+def _escape_like(value: str) -> str:
+    """
+    Escape LIKE pattern special chars in `value` with backslash (the
+    default LIKE escape char in Postgres)
+    """
+    return (
+        value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    )
+
+
+def _get_search_query():
+    """
+    Construct search query. Nickname prefix matches go first, then
+    matches are ranked by trigram similarity. `current_user_id` is
+    excluded, it's 0 for anonymous users
+    """
+    search_by = bindparam('search_by', type_=String)
+    like_exp = bindparam('like_exp', type_=String)
+    is_prefix = func.lower(users.c.nickname).like(bindparam('prefix_exp'))
+    rank = func.greatest(
+        func.similarity(users.c.nickname, search_by),
+        func.similarity(users.c.first_name, search_by),
+        func.similarity(users.c.last_name, search_by),
+    )
+    return select(USER_COLUMNS).where(and_(or_(
+        is_prefix,
+        users.c.nickname.ilike(like_exp),
+        users.c.first_name.ilike(like_exp),
+        users.c.last_name.ilike(like_exp)
+    ), users.c.id != bindparam('current_user_id'))).order_by(
+        is_prefix.desc(), rank.desc(), users.c.id
+    ).limit(bindparam('limit')).offset(bindparam('offset'))
+
+
+def _get_nickname_prefix_query():
+    """Construct nickname prefix search query"""
+    return select(USER_COLUMNS).where(and_(
+        func.lower(users.c.nickname).like(bindparam('prefix_exp')),
+        users.c.id != bindparam('current_user_id')
+    )).order_by(
+        func.lower(users.c.nickname), users.c.id
+    ).limit(bindparam('limit')).offset(bindparam('offset'))
+
+
+SEARCH_USERS_QUERY = QUERIES.register('search_users', _get_search_query())
+
+SEARCH_USERS_BY_NICKNAME_PREFIX_QUERY = QUERIES.register(
+    'search_users_by_nickname_prefix', _get_nickname_prefix_query()
+)
 
 
 class SearchUsersService:
     """Service to search users"""
 
-    def __init__(self, conn, current_user_id: Union[str, int, None]):
+    def __init__(self, conn, current_user_id: Union[str, int, None],
+            nickname_trie: Optional[NicknameTrie] = None):
         self._conn = conn
         self._current_user_id = current_user_id
+        self._nickname_trie = nickname_trie
+
+    def _get_query_params(self, search_by: str,
+            limit: int = SEARCH_DEFAULT_LIMIT, offset: int = 0) -> dict:
+        """Get search query parameters"""
+        return {
+            'search_by': search_by,
+            'like_exp': f"%{_escape_like(search_by)}%",
+            'prefix_exp': f"{_escape_like(search_by.lower())}%",
+            'current_user_id': self._current_user_id or 0,
+            'limit': limit, 'offset': offset,
+        }
 
-    def _get_query(self, search_by: str):
-        like_exp = f"%{search_by}%"
-        query = users.select().where(or_(
-            users.c.nickname.ilike(like_exp),
-            users.c.first_name.ilike(like_exp),
-            users.c.last_name.ilike(like_exp)
-        ))
-        if self._current_user_id:
-            query = query.where(users.c.id != self._current_user_id)
+    def _get_nickname_prefix_params(self, prefix: str, limit: int,
+            offset: int) -> dict:
+        """Get nickname prefix search query parameters"""
+        return {
+            'prefix_exp': f"{_escape_like(prefix.lower())}%",
+            'current_user_id': self._current_user_id or 0,
+            'limit': limit, 'offset': offset,
+        }
 
-        return query
+    async def _get_users_by_ids(self, user_ids: list[int]) -> list[dict]:
+        """Get users by ids keeping the order of `user_ids`"""
+        if not user_ids: return []
+        cursor = await QUERIES.execute(
+            self._conn, USERS_BY_IDS_QUERY, user_ids=user_ids
+        )
+        json_users = await fetch_dicts(cursor)
+        users_by_id = {user['id']: user for user in json_users}
+        return [
+            users_by_id[user_id] for user_id in user_ids
+            if user_id in users_by_id
+        ]
 
-    async def search(self, search_by: str) -> list[dict]:
+    async def _search_in_trie(self, prefix: str, limit: int,
+            offset: int) -> list[dict]:
+        """Search users by nickname prefix using the nicknames trie"""
+        user_ids = self._nickname_trie.complete(prefix, offset + limit + 1)
+        user_ids = [
+            user_id for user_id in user_ids
+            if user_id != self._current_user_id
+        ][offset:offset + limit]
+        return await self._get_users_by_ids(user_ids)
+
+    @timed
+    async def search(self, search_by: str, limit: int = SEARCH_DEFAULT_LIMIT,
+            offset: int = 0) -> list[dict]:
         """
         Search users by query in nickname, first_name, last_name
         fields
         """
-        query = self._get_query(search_by)
-        cursor = await self._conn.execute(query)
-        users = await cursor.fetchall()
-        json_users = [
-            UserSerializer.parse_obj(dict(user)).dict() for user in users
-        ]
+        cursor = await QUERIES.execute(
+            self._conn, SEARCH_USERS_QUERY,
+            **self._get_query_params(search_by, limit, offset)
+        )
+        json_users = await fetch_dicts(cursor)
+        return json_users
+
+    @timed
+    async def search_by_nickname_prefix(self, prefix: str,
+            limit: int = SEARCH_DEFAULT_LIMIT,
+            offset: int = 0) -> list[dict]:
+        """
+        Search users whose nickname starts with `prefix`, using the
+        nicknames trie if it's enabled
+        """
+        if self._nickname_trie is not None:
+            return await self._search_in_trie(prefix, limit, offset)
+
+        cursor = await QUERIES.execute(
+            self._conn, SEARCH_USERS_BY_NICKNAME_PREFIX_QUERY,
+            **self._get_nickname_prefix_params(prefix, limit, offset)
+        )
+        json_users = await fetch_dicts(cursor)
         return json_users
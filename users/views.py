@@ -1,17 +1,33 @@
-from aiohttp.web import json_response, Response, View
+from functools import partial, wraps
+
+from aiohttp.web import Response, StreamResponse, View
 from psycopg2.errors import UniqueViolation, ForeignKeyViolation
 from pydantic import ValidationError
 
+from ratingsite.compression import enable_stream_compression
+from ratingsite.db import get_read_db, remember_writes
+from ratingsite.encoders import dumps, json_response
+from ratingsite.ratelimit import rate_limited
+from ratingsite.tracing import trace_span
+
 from .services import (
     RegistrationService, LoginService, get_all_users, add_user_friend,
+    add_user_friends, queue_user_friend, invalidate_login,
     GetUserFriendsService, get_user_info, GetAnotherUserInfoService,
-    SearchUsersService
+    SearchUsersService, iter_all_users, UserProfilesLoader,
+    get_friend_suggestions, USERS_PAGE_MAX_LIMIT, SEARCH_DEFAULT_LIMIT,
+    SEARCH_MAX_LIMIT
+)
+from .graph import SUGGESTIONS_DEFAULT_LIMIT, SUGGESTIONS_MAX_LIMIT
+from .middlewares import skip_authentication
+from .serializers import (
+    RegistrationData, LoginData, UsersBatchData, FriendsBatchData
 )
-from .serializers import RegistrationData, LoginData
 
 
 def user_required(func):
 
+    @wraps(func)
     def wrapper(request):
         if not request.user:
             return json_response({'error': 'Not authenticated'}, status=403)
@@ -21,16 +37,22 @@ def user_required(func):
     return wrapper
 
 
+@skip_authentication
+@rate_limited
 class RegistrationView(View):
 
     async def _get_auth_data(self):
         request_body = await self.request.text()
-        auth_data = RegistrationData.parse_raw(request_body)
+        with trace_span('validation'):
+            auth_data = RegistrationData.parse_raw(request_body)
         return auth_data
 
     async def _registrate_user(self, auth_data):
         async with self.request.app['db'].acquire() as conn:
-            service = RegistrationService(conn)
+            service = RegistrationService(
+                conn, self.request.app['password_hasher'],
+                self.request.app['nickname_trie']
+            )
             response = await service.registrate_user(auth_data)
             return response
 
@@ -38,6 +60,11 @@ class RegistrationView(View):
         try:
             auth_data = await self._get_auth_data()
             response = await self._registrate_user(auth_data)
+            await self.request.app['response_cache'].invalidate(
+                auth_data.nickname
+            )
+            remember_writes(self.request.app, auth_data.nickname)
+            invalidate_login(self.request.app, auth_data.email)
             return json_response(response)
         except ValidationError as e:
             return json_response(e.json(), status=400)
@@ -45,18 +72,23 @@ class RegistrationView(View):
             return json_response({'error': 'User already exists'}, status=400)
 
 
+@skip_authentication
+@rate_limited
 class LoginView(View):
 
     async def _get_auth_data(self):
         request_body = await self.request.text()
-        auth_data = LoginData.parse_raw(request_body)
+        with trace_span('validation'):
+            auth_data = LoginData.parse_raw(request_body)
         return auth_data
 
     async def _login_user(self, auth_data):
-        async with self.request.app['db'].acquire() as conn:
-            service = LoginService(conn)
-            response = await service.login_user(auth_data)
-            return response
+        app = self.request.app
+        service = LoginService(
+            app['db'], app['password_hasher'], app['login_cache']
+        )
+        response = await service.login_user(auth_data)
+        return response
 
     async def post(self):
         try:
@@ -68,27 +100,136 @@ class LoginView(View):
             return json_response(e.json(), status=400)
 
 
+STREAM_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def _get_int_query_param(request, name: str):
+    """Get integer query parameter or None, raise ValueError if incorrect"""
+    value = request.query.get(name)
+    if value is None: return None
+    return int(value)
+
+
+def _get_pagination_params(request) -> tuple:
+    """
+    Get `after_id` and `limit` query params, raise ValueError if they are
+    incorrect
+    """
+    after_id = _get_int_query_param(request, 'after_id')
+    limit = _get_int_query_param(request, 'limit')
+    if limit is not None and not 0 < limit <= USERS_PAGE_MAX_LIMIT:
+        raise ValueError
+    return after_id, limit
+
+
+def _paginated_json_response(items: list, limit) -> Response:
+    """
+    Return json response with items page and the next page `after_id`
+    in X-Next-After-Id header if there can be the next page
+    """
+    response = json_response(items)
+    if limit is not None and len(items) == limit:
+        response.headers['X-Next-After-Id'] = str(items[-1]['id'])
+    return response
+
+
+async def _stream_all_users(request, stream_format: str) -> StreamResponse:
+    """Write all users chunk by chunk as NDJSON or JSON array"""
+    response = StreamResponse()
+    response.content_type = STREAM_CONTENT_TYPES[stream_format]
+    enable_stream_compression(request, response)
+    await response.prepare(request)
+    if stream_format == 'json': await response.write(b'[')
+    is_first = True
+    async with get_read_db(request).acquire() as conn:
+        async for chunk in iter_all_users(conn, request.user):
+            if stream_format == 'ndjson':
+                data = b''.join(dumps(user) + b'\n' for user in chunk)
+            else:
+                data = b','.join(dumps(user) for user in chunk)
+                if not is_first: data = b',' + data
+            is_first = False
+            await response.write(data)
+
+    if stream_format == 'json': await response.write(b']')
+    await response.write_eof()
+    return response
+
+
 async def all_users(request):
     """
     ---
     description: Return all users
     tags:
     - users
+    parameters:
+    - in: query
+      name: after_id
+      type: integer
+      description: return users with id greater than this one
+    - in: query
+      name: limit
+      type: integer
+      description: page size, the next page id is in X-Next-After-Id header
+    - in: query
+      name: stream
+      type: string
+      enum: [ndjson, json]
+      description: stream all users as NDJSON or JSON array
     responses:
         "200":
             description: successful operation
+        "400":
+            description: incorrect query parameters
     """
-    async with request.app['db'].acquire() as conn:
-        all_users = await get_all_users(conn, request.user)
+    stream_format = request.query.get('stream')
+    if stream_format is not None:
+        if stream_format not in STREAM_CONTENT_TYPES:
+            return json_response({
+                'error': 'stream should be one of: ndjson, json'
+            }, status=400)
+        return await _stream_all_users(request, stream_format)
+
+    try:
+        after_id, limit = _get_pagination_params(request)
+    except ValueError:
+        return json_response({
+            'error': f'after_id and limit should be integers, '
+                     f'0 < limit <= {USERS_PAGE_MAX_LIMIT}'
+        }, status=400)
+
+    async with get_read_db(request).acquire() as conn:
+        all_users = await get_all_users(
+            conn, request.user, after_id, limit
+        )
+
+    return _paginated_json_response(all_users, limit)
+
+
+async def _queue_friend(request) -> Response:
+    try:
+        is_queued = await queue_user_friend(request)
+    except ValueError:
+        return json_response(
+            {'error': 'User ID should be a positive 32-bit integer'},
+            status=400
+        )
 
-    return json_response(all_users)
+    if is_queued: remember_writes(request.app, request.user['nickname'])
+    return Response(status=202 if is_queued else 204)
 
 
 @user_required
 async def add_friend(request):
+    if request.app['write_behind'] is not None:
+        return await _queue_friend(request)
+
     async with request.app['db'].acquire() as conn:
         try:
-            await add_user_friend(conn, request)
+            friend_nickname = await add_user_friend(conn, request)
         except UniqueViolation:
             return json_response(
                 {'error': 'User already in friends'}, status=400
@@ -98,15 +239,122 @@ async def add_friend(request):
                 {'error': "User with this ID doesn't exist"}, status=400
             )
 
+    if friend_nickname:
+        await request.app['response_cache'].invalidate(
+            request.user['nickname'], friend_nickname
+        )
+        remember_writes(
+            request.app, request.user['nickname'], friend_nickname
+        )
     return Response(status=204)
 
 
-async def get_user_friends(request):
-    user_nickname = request.match_info['user_nickname']
+@user_required
+async def add_friends_batch(request):
+    """
+    ---
+    description: Add many users to friends of the current user
+    tags:
+    - users
+    parameters:
+    - in: body
+      name: body
+      schema:
+        type: object
+        properties:
+          ids:
+            type: array
+            items:
+              type: integer
+    responses:
+        "200":
+            description: result of every id in the passed order (added,
+                already_added, not_found, self or duplicate)
+        "400":
+            description: incorrect batch data
+    """
+    request_body = await request.text()
+    try:
+        with trace_span('validation'):
+            batch_data = FriendsBatchData.parse_raw(request_body)
+    except ValidationError as e:
+        return json_response(e.json(), status=400)
+
     async with request.app['db'].acquire() as conn:
+        try:
+            results, added_nicknames = await add_user_friends(
+                conn, request, batch_data.ids
+            )
+        except ForeignKeyViolation:
+            # The user is deleted between the check and the insert
+            return json_response(
+                {'error': "User with this ID doesn't exist"}, status=400
+            )
+
+    if added_nicknames:
+        await request.app['response_cache'].invalidate(
+            request.user['nickname'], *added_nicknames
+        )
+        remember_writes(
+            request.app, request.user['nickname'], *added_nicknames
+        )
+    return json_response(results)
+
+
+@user_required
+async def friend_suggestions(request):
+    """
+    ---
+    description: Return friends of the current user friends ordered by
+        the number of mutual friends
+    tags:
+    - users
+    parameters:
+    - in: query
+      name: limit
+      type: integer
+    responses:
+        "200":
+            description: users with mutual_friends count
+        "400":
+            description: incorrect query parameters
+        "503":
+            description: friendship graph is disabled
+    """
+    graph = request.app['friendship_graph']
+    if graph is None:
+        return json_response(
+            {'error': 'Friendship graph is disabled'}, status=503
+        )
+
+    try:
+        limit = (
+            _get_int_query_param(request, 'limit') or
+            SUGGESTIONS_DEFAULT_LIMIT
+        )
+        if not 0 < limit <= SUGGESTIONS_MAX_LIMIT: raise ValueError
+    except ValueError:
+        return json_response({
+            'error': f'limit should be integer, '
+                     f'0 < limit <= {SUGGESTIONS_MAX_LIMIT}'
+        }, status=400)
+
+    async with get_read_db(request).acquire() as conn:
+        suggestions = await get_friend_suggestions(
+            conn, graph, request.user['id'], limit
+        )
+
+    return json_response(suggestions)
+
+
+async def _load_user_friends(request, user_nickname: str, after_id,
+        limit) -> Response:
+    async with get_read_db(request, user_nickname).acquire() as conn:
         try:
             service = GetUserFriendsService(conn)
-            user_friends = await service.get_friends_by_nick(user_nickname)
+            user_friends = await service.get_friends_by_nick(
+                user_nickname, after_id, limit
+            )
         except ForeignKeyViolation:
             return json_response({
                 'error': "User with this ID doesn't exist"
@@ -116,21 +364,59 @@ async def get_user_friends(request):
                 'error': 'There is no user with this nickname'
             }, status=400)
 
-    return json_response(user_friends)
+    return _paginated_json_response(user_friends, limit)
+
+
+@skip_authentication
+async def get_user_friends(request):
+    """
+    ---
+    description: Return friends of the user (users who follow each other)
+    tags:
+    - users
+    parameters:
+    - in: query
+      name: after_id
+      type: integer
+      description: return friends with id greater than this one
+    - in: query
+      name: limit
+      type: integer
+      description: page size, the next page id is in X-Next-After-Id header
+    responses:
+        "200":
+            description: successful operation
+        "400":
+            description: incorrect query parameters or unknown user
+    """
+    user_nickname = request.match_info['user_nickname']
+    try:
+        after_id, limit = _get_pagination_params(request)
+    except ValueError:
+        return json_response({
+            'error': f'after_id and limit should be integers, '
+                     f'0 < limit <= {USERS_PAGE_MAX_LIMIT}'
+        }, status=400)
+
+    return await request.app['response_cache'].get_response(
+        request, user_nickname, f'friends:{after_id}:{limit}', partial(
+            _load_user_friends, request, user_nickname, after_id, limit
+        )
+    )
 
 
 @user_required
 async def current_user_info(request):
-    async with request.app['db'].acquire() as conn:
+    async with get_read_db(request).acquire() as conn:
         user_info = await get_user_info(conn, request.user['nickname'])
 
     return json_response(user_info)
 
 
-async def another_user_info(request):
-    current_user_id = request.user['id'] if request.user else None
-    another_user_nickname = request.match_info['user_nickname']
-    async with request.app['db'].acquire() as conn:
+async def _load_another_user_info(request, current_user_id,
+        another_user_nickname: str) -> Response:
+    read_db = get_read_db(request, another_user_nickname)
+    async with read_db.acquire() as conn:
         info_service = GetAnotherUserInfoService(conn, current_user_id)
         try:
             user_info = await info_service.get_info(another_user_nickname)
@@ -142,10 +428,119 @@ async def another_user_info(request):
     return json_response(user_info)
 
 
+async def another_user_info(request):
+    current_user_id = request.user['id'] if request.user else None
+    another_user_nickname = request.match_info['user_nickname']
+    return await request.app['response_cache'].get_response(
+        request, another_user_nickname, f'profile:{current_user_id}', partial(
+            _load_another_user_info, request, current_user_id,
+            another_user_nickname
+        )
+    )
+
+
+async def users_batch(request):
+    """
+    ---
+    description: Return full infos of users by ids or nicknames
+    tags:
+    - users
+    parameters:
+    - in: body
+      name: body
+      schema:
+        type: object
+        properties:
+          ids:
+            type: array
+            items:
+              type: integer
+          nicknames:
+            type: array
+            items:
+              type: string
+    responses:
+        "200":
+            description: infos in the order of passed ids or nicknames,
+                null for nonexistent users
+        "400":
+            description: incorrect batch data
+    """
+    request_body = await request.text()
+    try:
+        with trace_span('validation'):
+            batch_data = UsersBatchData.parse_raw(request_body)
+    except ValidationError as e:
+        return json_response(e.json(), status=400)
+
+    current_user_id = request.user['id'] if request.user else None
+    read_db = get_read_db(request, *(batch_data.nicknames or ()))
+    async with read_db.acquire() as conn:
+        loader = UserProfilesLoader(conn, current_user_id)
+        if batch_data.ids is not None:
+            user_infos = await loader.load_many_by_ids(batch_data.ids)
+        else:
+            user_infos = await loader.load_many_by_nicknames(
+                batch_data.nicknames
+            )
+
+    return json_response(user_infos)
+
+
+def _get_search_params(request) -> tuple:
+    """
+    Get `limit` and `offset` query params, raise ValueError if they are
+    incorrect
+    """
+    limit = _get_int_query_param(request, 'limit') or SEARCH_DEFAULT_LIMIT
+    offset = _get_int_query_param(request, 'offset') or 0
+    if not 0 < limit <= SEARCH_MAX_LIMIT or offset < 0:
+        raise ValueError
+    return limit, offset
+
+
 async def search_users(request):
+    """
+    ---
+    description: Search users by nickname, first name and last name
+    tags:
+    - users
+    parameters:
+    - in: query
+      name: by
+      type: string
+      enum: [nickname]
+      description: search only by nickname prefix
+    - in: query
+      name: limit
+      type: integer
+    - in: query
+      name: offset
+      type: integer
+    responses:
+        "200":
+            description: successful operation
+        "400":
+            description: incorrect query parameters
+    """
     current_user_id = request.user['id'] if request.user else None
     search_by = request.match_info['search_by']
-    async with request.app['db'].acquire() as conn:
-        search_service = SearchUsersService(conn, current_user_id)
-        users = await search_service.search(search_by)
+    try:
+        limit, offset = _get_search_params(request)
+    except ValueError:
+        return json_response({
+            'error': f'limit and offset should be integers, '
+                     f'0 < limit <= {SEARCH_MAX_LIMIT}, offset >= 0'
+        }, status=400)
+
+    async with get_read_db(request).acquire() as conn:
+        search_service = SearchUsersService(
+            conn, current_user_id, request.app['nickname_trie']
+        )
+        if request.query.get('by') == 'nickname':
+            users = await search_service.search_by_nickname_prefix(
+                search_by, limit, offset
+            )
+        else:
+            users = await search_service.search(search_by, limit, offset)
         return json_response(users)